@@ -0,0 +1,107 @@
+###################################################
+# Async runtime
+# Author      : Adeeb
+# Version     : 1.0
+# Description : asyncio update dispatcher for Bot
+###################################################
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+
+class AsyncRunner:
+    """
+    Receive updates with telebot's async client and run them concurrently
+
+    - updates of different chats run in parallel
+    - updates of the same chat run one after another, in arrival order
+    - handlers (telegram sends and dbman calls) run on a bounded thread pool
+    - at most max_in_flight update batches are accepted at once, polling
+      waits for a free slot before fetching more updates
+    - a failed getUpdates (network error, 5xx, 409) is retried with an
+      exponential back off, from retry_delay up to max_retry_delay seconds
+
+    api_url : (optional) bot api url of the async client, e.g. a local fake api,
+              the async client does not use telebot.apihelper.API_URL
+    """
+
+    def __init__(self, bot, max_in_flight: int = 32, workers: int = 8, poll_timeout: int = 20,
+                 retry_delay: float = 1, max_retry_delay: float = 60, api_url: str = None):
+        if api_url:
+            asyncio_helper.API_URL = api_url
+        self.bot = bot
+        self.client = AsyncTeleBot(bot.bot.token)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+        self.max_in_flight = max_in_flight
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._slots = None
+        self._chat_locks = {}
+        self._chat_pending = {}
+        self._tasks = set()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        try:
+            await self.poll()
+        finally:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self.client.close_session()
+            self.executor.shutdown(wait=True)
+
+    async def poll(self):
+        offset = None
+        delay = self.retry_delay
+        while True:
+            try:
+                updates = await self.client.get_updates(offset=offset, timeout=self.poll_timeout)
+            except Exception as e:
+                # offset is kept, nothing is lost or handled twice
+                self.bot.log(f"poll_err : {e} : retrying in {delay:g}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            delay = self.retry_delay
+            if not updates:
+                continue
+            offset = updates[-1].update_id + 1
+            await self.dispatch(updates)
+
+    async def dispatch(self, updates):
+        """
+        Queue a list of updates, grouped into one handler call per chat
+        """
+        chats = {}
+        for update in updates:
+            chats.setdefault(self.bot.chat_id_of(update), []).append(update)
+
+        for chat_id, chat_updates in chats.items():
+            await self._slots.acquire()
+            self._chat_pending[chat_id] = self._chat_pending.get(chat_id, 0) + 1
+            lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+            task = asyncio.create_task(self._handle_(chat_id, lock, chat_updates))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _handle_(self, chat_id, lock, updates):
+        loop = asyncio.get_running_loop()
+        try:
+            async with lock:
+                await loop.run_in_executor(self.executor, self.bot.process_updates, updates)
+        except Exception as e:
+            self.bot.log(f"async_err : {e} : chat {chat_id}")
+        finally:
+            self._slots.release()
+            self._chat_pending[chat_id] -= 1
+            if not self._chat_pending[chat_id]:
+                del self._chat_pending[chat_id]
+                del self._chat_locks[chat_id]
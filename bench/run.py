@@ -0,0 +1,329 @@
+###################################################
+# Benchmarks
+# Author      : Adeeb
+# Version     : 1.0
+# Description : times dbman and search hot paths on sqlite catalogs
+###################################################
+"""
+Usage:
+    python3 bench/run.py                                   (1k, 100k and 1M rows)
+    python3 bench/run.py --sizes 1k,100k --output bench/baseline.json
+    python3 bench/run.py --sizes 1k,100k --baseline bench/baseline.json
+
+Catalogs are generated once with a fixed seed and kept in bench/data/, every
+write benchmark runs on a fresh copy so runs stay comparable. Results are
+printed as json (or written to --output). With --baseline the fastest run of
+every benchmark is compared to the saved run and the script exits with 1 when
+one of them is slower by more than --threshold and by more than --noise-floor
+milliseconds. The minimum is compared, not the median, as it is the run least
+disturbed by the rest of the machine.
+
+telebot.TeleBot is replaced by StubTeleBot, so Bot.* benchmarks measure the
+bot's own work and make no network calls.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import types as pytypes
+from contextlib import redirect_stdout
+from datetime import datetime
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA_DIR = os.path.join(ROOT, "bench", "data")
+TABLE_NAME = "Files"
+SEED = 20240101
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+
+WORDS = [
+    "iron", "man", "hulk", "spider", "batman", "dark", "knight", "rises", "return", "king",
+    "lord", "rings", "star", "wars", "empire", "strikes", "back", "matrix", "reloaded", "avatar",
+    "titanic", "alien", "predator", "terminator", "judgment", "day", "jurassic", "park", "world", "fast",
+    "furious", "mission", "impossible", "ghost", "protocol", "toy", "story", "finding", "nemo", "frozen",
+]
+QUALITIES = ["480p", "720p", "1080p", "2160p"]
+EXTENSIONS = [("mkv", "document"), ("mp4", "video"), ("avi", "document")]
+
+
+# ================ Catalogs ================ #
+
+def file_row(rng: random.Random, n: int):
+    words = rng.sample(WORDS, rng.randint(2, 4))
+    ext, file_type = rng.choice(EXTENSIONS)
+    name = f"{'.'.join(words)}.{rng.randint(1970, 2024)}.{rng.choice(QUALITIES)}.{ext}"
+    return name, f"file-id-{n}", f"uid-{n}", file_type
+
+
+def build_catalog(rows: int):
+    """
+    Returns the path of a catalog with rows files, generating it when missing
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f"catalog_{rows}.db")
+    if os.path.exists(path):
+        return path
+
+    rng = random.Random(SEED)
+    tmp_path = path + ".tmp"
+    conn = sqlite3.connect(tmp_path)
+    # same schema as data.db
+    conn.execute(
+        f"CREATE TABLE {TABLE_NAME} (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, name TEXT NOT NULL, "
+        "file_id TEXT NOT NULL, file_uid TEXT NOT NULL, file_type TEXT NOT NULL)"
+    )
+    batch = 10_000
+    for start in range(0, rows, batch):
+        conn.executemany(
+            f"INSERT INTO {TABLE_NAME} (name, file_id, file_uid, file_type) VALUES (?, ?, ?, ?)",
+            [file_row(rng, n) for n in range(start, min(start + batch, rows))],
+        )
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+    return path
+
+
+# ================ Telegram stand-ins ================ #
+
+class StubTeleBot:
+    """
+    Accepts every TeleBot call the Bot makes and does nothing
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.token = "stub"
+
+    def set_update_listener(self, listener):
+        pass
+
+    def message_handler(self, *args, **kwargs):
+        return lambda func: func
+
+    def callback_query_handler(self, *args, **kwargs):
+        return lambda func: func
+
+    def send_message(self, *args, **kwargs):
+        pass
+
+    def send_document(self, *args, **kwargs):
+        pass
+
+    def send_video(self, *args, **kwargs):
+        pass
+
+    def delete_message(self, *args, **kwargs):
+        pass
+
+
+def fake_message(chat_id: int, text: str = None, name: str = None, file_uid: str = None, file_type: str = "document"):
+    file = pytypes.SimpleNamespace(file_name=name, file_id=f"file-id-{file_uid}", file_unique_id=file_uid)
+    return pytypes.SimpleNamespace(
+        id=1, message_id=1, text=text, forward_date=None,
+        content_type=file_type if name else "text",
+        chat=pytypes.SimpleNamespace(id=chat_id, username="bench"),
+        document=file, video=file,
+    )
+
+
+# ================ Timing ================ #
+
+def measure(func, repeat: int = 5, budget: float = 2.0, setup=None, min_runs: int = 3):
+    """
+    Run func at least min_runs times (repeat if lower) and up to repeat times
+    while within budget seconds, returns the timings in milliseconds
+    """
+    timings = []
+    spent = 0
+    min_runs = min(min_runs, repeat)
+    while len(timings) < repeat and (len(timings) < min_runs or spent < budget):
+        args = setup() if setup is not None else ()
+        start = perf_counter()
+        func(*args)
+        elapsed = perf_counter() - start
+        timings.append(elapsed * 1000)
+        spent += elapsed
+    return {
+        "runs": len(timings),
+        "min_ms": round(min(timings), 4),
+        "median_ms": round(statistics.median(timings), 4),
+        "mean_ms": round(statistics.fmean(timings), 4),
+    }
+
+
+def run_size(rows: int, repeat: int):
+    import settings
+    import telebot
+    from dbman import DBMan, close_pools
+
+    catalog = build_catalog(rows)
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    db_path = os.path.join(workdir, "catalog.db")
+    shutil.copyfile(catalog, db_path)
+
+    settings.DB_ENGINE = "sqlite"
+    settings.DB_CONFIG = {"NAME": db_path}
+    settings.TABLE_NAME = TABLE_NAME
+    settings.SEARCH_BACKEND = "memory"
+    # time the insert itself, not handing rows to the background writer
+    settings.WRITE_BEHIND = False
+    telebot.TeleBot = StubTeleBot
+
+    db = DBMan()
+    db.DB_ENGINE = "sqlite"
+    db.DB_CONFIG = settings.DB_CONFIG
+    db.table_name = TABLE_NAME
+
+    rng = random.Random(SEED + rows)
+    uids = [f"uid-{rng.randrange(rows)}" for _ in range(1000)]
+    counter = iter(range(rows, rows * 10))
+    results = {}
+
+    try:
+        results["db_fetch_all"] = measure(db.db_fetch_all, repeat)
+        results["db_fetch_col"] = measure(lambda: db.db_fetch_col(["name"]), repeat)
+        results["db_fetch_row"] = measure(
+            lambda uid: db.db_fetch_row(file_uid=uid), repeat * 20,
+            setup=lambda: (rng.choice(uids),),
+        )
+        results["db_insert"] = measure(
+            lambda row: db.db_insert(row), repeat * 20,
+            setup=lambda: (dict(zip(("name", "file_id", "file_uid", "file_type"), file_row(rng, next(counter)))),),
+        )
+
+        import bot as botmod
+
+        bots = []
+        # builds the search index from the whole catalog
+        results["Bot.__init__"] = measure(lambda: bots.append(botmod.Bot(run=False)), 1)
+        bot = bots[0]
+
+        def new_messages():
+            batch = []
+            for _ in range(100):
+                name, _, uid, file_type = file_row(rng, next(counter))
+                batch.append(fake_message(1, name=name, file_uid=uid, file_type=file_type))
+            return (batch,)
+
+        results["Bot.save_data[100]"] = measure(bot.save_data, repeat, setup=new_messages)
+
+        queries = [" ".join(rng.sample(WORDS, rng.randint(1, 2))) for _ in range(100)]
+        results["Bot.search_data"] = measure(
+            bot.search_data, repeat * 20,
+            setup=lambda: (fake_message(rng.randrange(1000), text="/search " + rng.choice(queries)),),
+        )
+        bot.sender.close()
+    finally:
+        close_pools()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def merge_rounds(rounds: list[dict]):
+    """
+    Combine the results of run_size rounds: fastest run, median of the medians
+    """
+    merged = {}
+    for name in rounds[0]:
+        timings = [results[name] for results in rounds]
+        runs = sum(timing["runs"] for timing in timings)
+        merged[name] = {
+            "runs": runs,
+            "min_ms": min(timing["min_ms"] for timing in timings),
+            "median_ms": round(statistics.median(timing["median_ms"] for timing in timings), 4),
+            "mean_ms": round(sum(timing["mean_ms"] * timing["runs"] for timing in timings) / runs, 4),
+        }
+    return merged
+
+
+# ================ Baseline ================ #
+
+def compare(results: dict, baseline: dict, threshold: float, noise_floor: float = 1.0):
+    """
+    Print the fastest run of every benchmark next to the baseline, returns the regressions
+
+    A benchmark regressed when it is slower by more than threshold (ratio) and
+    by more than noise_floor milliseconds, sub-millisecond jitter is never one
+    """
+    regressions = []
+    print(f"{'size':>6} {'benchmark':<22} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+    for size, benches in results["results"].items():
+        for name, timing in benches.items():
+            base = baseline.get("results", {}).get(size, {}).get(name)
+            if base is None:
+                print(f"{size:>6} {name:<22} {'-':>12} {timing['min_ms']:>12.3f} {'new':>7}")
+                continue
+            ratio = timing["min_ms"] / base["min_ms"] if base["min_ms"] else 1.0
+            flag = ""
+            if ratio > threshold and timing["min_ms"] - base["min_ms"] > noise_floor:
+                flag = "  REGRESSION"
+                regressions.append((size, name, ratio))
+            print(f"{size:>6} {name:<22} {base['min_ms']:>12.3f} {timing['min_ms']:>12.3f} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dbman and search hot paths")
+    parser.add_argument("--sizes", default="1k,100k,1M", help=f"comma separated, of {', '.join(SIZES)}")
+    parser.add_argument("--repeat", type=int, default=10, help="runs of the full table benchmarks (x20 for single row ones)")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="times the whole suite runs per size, spread in time so a busy moment of the machine is not all we see")
+    parser.add_argument("--output", help="write the json results to this file")
+    parser.add_argument("--baseline", help="json results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.3, help="slowdown ratio reported as a regression")
+    parser.add_argument("--noise-floor", type=float, default=1.0,
+                        help="milliseconds a benchmark must slow down by to be reported as a regression")
+    args = parser.parse_args()
+
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    for size in sizes:
+        if size not in SIZES:
+            parser.error(f"unknown size '{size}', use {', '.join(SIZES)}")
+
+    results = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": SEED,
+            "repeat": args.repeat,
+            "rounds": args.rounds,
+        },
+        "results": {},
+    }
+    for size in sizes:
+        print(f"running {size} ...", file=sys.stderr)
+        # the bot logs every saved file, keep stdout for the results
+        with redirect_stdout(sys.stderr):
+            rounds = [run_size(SIZES[size], args.repeat) for _ in range(max(args.rounds, 1))]
+        results["results"][size] = merge_rounds(rounds)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold, args.noise_floor)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.2f}x")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,41 +6,89 @@
 
 import telebot
 from telebot import types
-import os, sqlite3, platform
+import os, sqlite3, platform, mimetypes
 from datetime import datetime
 
-from dbman import DBMan
+from dbman import DBMan, WriteBehindQueue, query_stats
+from dbman.dbman import DataNotFoundError, encode_page_token, decode_page_token
+from search import SearchIndex
+from sessions import LRUStore, SearchSession
+from sender import SendScheduler
+from metrics import HandlerStats, render_prometheus, serve_metrics
 import settings
 
+if settings.TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = settings.TELEGRAM_API_URL
+
 
 class Bot():
 
     # data structure (id, name, file_id, file_uid, file_type)
 
-    def __init__(self):
+    def __init__(self, run: bool = True, processes: int = 1):
 
         """
         1- Forward tag remover
         2- File search
+
+        processes : bot processes sending with the same token (ProcessRunner workers),
+                    each one gets its share of SEND_GLOBAL_RATE
         """
-        self.bot = telebot.TeleBot(settings.API_KEY)
+        # outside polling mode updates are handed to process_updates by a runner
+        # which already runs them on its own threads
+        self.bot = telebot.TeleBot(settings.API_KEY, threaded=settings.RUN_MODE == "polling")
         self.log("Bot started...")
-        self.search_name_list = {}
+        self.search_sessions = LRUStore(settings.SEARCH_SESSION_MAX, settings.SEARCH_SESSION_TTL)
         self.messages_dict = {}
+        self.sender = SendScheduler(
+            self.bot,
+            workers=settings.SEND_WORKERS,
+            global_rate=settings.SEND_GLOBAL_RATE / processes,
+            chat_rate=settings.SEND_CHAT_RATE,
+            chat_burst=settings.SEND_CHAT_BURST,
+            retries=settings.SEND_RETRIES,
+        )
 
-        self.bot.set_update_listener(self.main)
+        self.handler_stats = HandlerStats()
+        self.bot.set_update_listener(self.handler_stats.timed("updates")(self.main))
 
         self.db = DBMan()
         self.db.DB_ENGINE = settings.DB_ENGINE
         self.db.DB_CONFIG = settings.DB_CONFIG
         self.db.table_name = settings.TABLE_NAME
+        # file_uid is fetched by search_call_handle and is the conflict target of save_data
+        # catalogs saved before the index existed may hold a file twice, the first copy is kept
+        self.db.db_create_index(["file_uid"], unique=True, drop_duplicates=True)
+        self.db.db_create_index(["name"])
+
+        # "db" keeps the catalog out of bot memory and searches with the database full text index
+        if settings.SEARCH_BACKEND == "db":
+            self.index = None
+            self.db.db_create_fts("name")
+        else:
+            self.index = SearchIndex(cache_size=settings.SEARCH_CACHE_SIZE, fuzzy=settings.SEARCH_FUZZY)
+            self.build_index()
+
+        self.writer = None
+        if settings.WRITE_BEHIND:
+            self.writer = WriteBehindQueue(
+                self.db,
+                batch_size=settings.WRITE_BATCH_SIZE,
+                flush_interval=settings.WRITE_FLUSH_INTERVAL,
+                max_pending=settings.WRITE_MAX_PENDING,
+                conflict_cols=["file_uid"],
+                on_flush=self.data_saved,
+                log=self.log,
+            )
 
-        @self.bot.message_handler(commands=["help", "up", "about"])
+        @self.bot.message_handler(commands=["help", "up", "about", "stats"])
+        @self.handler_stats.timed("command")
         def command_handler_func(message):
             cmd_func = {
                 "/help": self.help_desk,
                 "/up": self.up,
                 "/about": self.about,
+                "/stats": self.stats,
             }
             try:
                 cmd_func[message.text](message)
@@ -48,6 +96,7 @@ class Bot():
                 self.log(f"cmd_err : {e} : {message.text}")
 
         @self.bot.callback_query_handler(func=lambda call: call.data in ["ftr_btn", "done"])
+        @self.handler_stats.timed("call")
         def call_handle_func(call):
             calls_dict = {
                 "ftr_btn": self.ftr_btn_call_handle,
@@ -59,19 +108,61 @@ class Bot():
                 self.log(f"call_err : {e} : {call.data}")
 
         @self.bot.callback_query_handler(func=lambda call: call.data.split("#")[0] == "search")
+        @self.handler_stats.timed("search_call")
         def search_call_handle_func(call):
             self.search_call_handle(call)
 
         @self.bot.callback_query_handler(func=lambda call: call.data.split("#")[0] == "next")
+        @self.handler_stats.timed("next_call")
         def next_call_handle_func(call):
             self.nxt_btn_call_handle(call)
 
         @self.bot.callback_query_handler(func=lambda call: call.data.split("#")[0] == "back")
+        @self.handler_stats.timed("back_call")
         def back_call_handle_func(call):
             self.back_btn_call_handle(call)
 
+        if run:
+            self.run()
+
+    def run(self):
+
         ################################################################################################################
 
+        if settings.METRICS_PORT:
+            server = serve_metrics(self.render_metrics, settings.METRICS_HOST, settings.METRICS_PORT)
+            self.log(f"metrics on http://{settings.METRICS_HOST}:{server.port}/metrics")
+
+        if settings.RUN_MODE == "async":
+            from aiobot import AsyncRunner
+
+            self.log("running in async mode")
+            AsyncRunner(
+                self,
+                max_in_flight=settings.ASYNC_MAX_IN_FLIGHT,
+                workers=settings.ASYNC_WORKERS,
+                api_url=settings.TELEGRAM_API_URL,
+            ).run()
+            return
+
+        if settings.RUN_MODE == "webhook":
+            from webhook import WebhookServer, webhook_secret
+
+            secret = webhook_secret(settings.WEBHOOK_SECRET, settings.WEBHOOK_URL)
+            server = WebhookServer(
+                self,
+                host=settings.WEBHOOK_HOST,
+                port=settings.WEBHOOK_PORT,
+                path=settings.WEBHOOK_PATH,
+                secret=secret,
+            )
+            if settings.WEBHOOK_URL:
+                self.bot.remove_webhook()
+                self.bot.set_webhook(url=settings.WEBHOOK_URL, secret_token=secret)
+            self.log(f"running in webhook mode on port {server.port}")
+            server.serve_forever()
+            return
+
         # self.bot.polling()
         try:
             self.bot.polling(none_stop=True)
@@ -81,6 +172,7 @@ class Bot():
         except Exception as e:
             self.log(f"Bot_down_err : {e}")
             self.log("restarting Bot...")
+            self.close()
             self.__init__()
 
         ################################################################################################################
@@ -89,7 +181,70 @@ class Bot():
 
         print(f"[{datetime.now()}] {txt}")
 
+    @staticmethod
+    def chat_id_of(update):
+        if update.message is not None:
+            return update.message.chat.id
+        if update.callback_query is not None:
+            return update.callback_query.from_user.id
+        return None
+
+    def process_updates(self, updates):
+        """
+        Run a list of telebot Update objects through the registered handlers
+        """
+        self.bot.process_new_updates(updates)
+
+    def build_index(self):
+        # read before the build, refresh_index may re-read a few files but never misses one
+        self.index_last_id = self.last_file_id()
+        files = self.db.db_iter_rows(col_names=["name", "file_uid"], order_by=["id"], row_type="tuple")
+        self.index.build(files)
+        self.log(f"index built : {len(self.index)} files")
+
+    def last_file_id(self):
+        try:
+            return self.db.db_fetch_row(col_names=["id"], order_by=["id"], desc=True, limit=1)[0]["id"]
+        except DataNotFoundError:
+            return 0
+
+    def refresh_index(self, full: bool = False):
+        """
+        Add the files other processes saved since the index was built or refreshed
+
+        Files are found by id, which postgres hands out before commit, so a file
+        committed after one with a higher id is missed; full=True re-reads every
+        file and adds the ones the index does not have
+        """
+        if self.index is None:
+            return
+        if full:
+            last_id = self.last_file_id()
+            files = self.db.db_iter_rows(col_names=["name", "file_uid"], order_by=["id"], row_type="tuple")
+            added = sum(self.index.add(name, file_uid) for name, file_uid in files)
+            self.index_last_id = max(self.index_last_id, last_id)
+            if added:
+                self.log(f"index re-synced : {added} files added")
+            return
+        after = encode_page_token(self.index_last_id)
+        while after is not None:
+            page = self.db.db_fetch_page(after=after, limit=1000, col_names=["name", "file_uid"])
+            for row in page.rows:
+                self.index.add(row["name"], row["file_uid"])
+                self.index_last_id = row["id"]
+            after = page.next
+
+    def close(self):
+        """
+        Write the queued files and finish the queued sends
+        """
+        if self.writer is not None:
+            self.writer.close()
+        self.sender.close()
+
     def main(self, messages):
+        media = []
+        saved = []
         for message in messages:
 
             if message.text is not None:
@@ -110,6 +265,11 @@ class Bot():
                             "usage : /search <movie name>"
                         )
                     else:
+                        if media:
+                            # files forwarded earlier in the batch must be found by this search
+                            self.save_data(media, wait=True)
+                            saved.extend(media)
+                            media = []
                         self.search_data(message)
 
             if message.content_type in ["document", "video"]:
@@ -117,10 +277,12 @@ class Bot():
                     self.messages_dict[message.chat.id].append(message)
                 else:
                     self.messages_dict[message.chat.id] = [message]
-                self.save_data(message)
+                media.append(message)
 
-        if len(self.messages_dict) != 0:
-            self.tool()
+        if media:
+            self.save_data(media)
+        if media or saved:
+            self.tool({message.chat.id for message in saved + media})
 
     def start(self, message):
         user = message.chat.username
@@ -142,14 +304,64 @@ class Bot():
             settings.ABOUT_REPLAY,
         )
 
+    def render_metrics(self):
+        gauges = {
+            "bot_search_sessions": ("Chats with a stored search", len(self.search_sessions)),
+        }
+        counters = {
+            "bot_sends_total": ("Files sent by the send scheduler", self.sender.sent),
+            "bot_send_failures_total": ("Sends which failed", self.sender.failed),
+            "bot_send_throttled_total": ("Sends answered with 429", self.sender.throttled),
+        }
+        if self.index is not None:
+            gauges["bot_index_files"] = ("Files in the search index", len(self.index))
+            cache = self.index.cache_stats()
+            if cache is not None:
+                gauges["bot_search_cache_hit_ratio"] = ("Search result cache hit rate", cache["hit_rate"])
+                counters["bot_search_cache_hits_total"] = ("Searches answered from the result cache", cache["hits"])
+                counters["bot_search_cache_misses_total"] = ("Searches not in the result cache", cache["misses"])
+        if self.writer is not None:
+            gauges["bot_write_queue_pending"] = ("Files waiting for the write-behind queue", len(self.writer))
+            counters["bot_write_queue_written_total"] = ("Files written by the write-behind queue", self.writer.written)
+            counters["bot_write_queue_rejected_total"] = ("Files the write-behind queue could not write", self.writer.dropped)
+        return render_prometheus(query_stats, self.handler_stats, gauges, counters)
+
+    def stats(self, message):
+        if message.chat.id not in settings.ADMIN_IDS:
+            return
+
+        lines = ["Handlers (count, mean ms, p95 ms, errors)"]
+        for name, stats in sorted(self.handler_stats.snapshot().items()):
+            lines.append(f"{name} : {stats['count']}, {stats['mean_ms']:.1f}, {stats['p95_ms']:.0f}, {stats['errors']}")
+
+        lines.append("")
+        lines.append("Top queries by total time (count, mean ms, rows)")
+        shapes = sorted(query_stats.snapshot().items(), key=lambda item: item[1]["total_s"], reverse=True)
+        for query, stats in shapes[:settings.STATS_TOP_QUERIES]:
+            lines.append(f"{stats['count']}, {stats['mean_ms']:.1f}, {stats['rows']} : {query[:120]}")
+        lines.append(f"slow queries : {sum(stats['slow'] for _, stats in shapes)}")
+
+        lines.append("")
+        if self.index is not None:
+            lines.append(f"index : {len(self.index)} files, cache {self.index.cache_stats()}")
+        lines.append(f"search sessions : {len(self.search_sessions)}")
+        if self.writer is not None:
+            lines.append(f"write queue : {len(self.writer)} pending, {self.writer.written} written, {self.writer.dropped} dropped")
+        lines.append(f"sends : {self.sender.sent} sent, {self.sender.failed} failed, {self.sender.throttled} throttled")
+
+        self.bot.send_message(
+            message.chat.id,
+            "\n".join(lines),
+        )
+
     def up(self, message):
         self.bot.send_message(
             message.chat.id,
             "I am up",
         )
 
-    def tool(self):
-        for chat_id in self.messages_dict.keys():
+    def tool(self, chat_ids):
+        for chat_id in chat_ids:
             markup = types.InlineKeyboardMarkup()
             ftr_btn = types.InlineKeyboardButton(
                 " Remove forward tag ",
@@ -170,110 +382,209 @@ class Bot():
 
     def send_doc(self, message):
         self.log(f"doc_rcv : {message.document.file_name}")
-        self.bot.send_document(
+        sent = self.sender.submit(
+            message.chat.id,
+            "send_document",
             message.chat.id,
             message.document.file_id,
         )
-        self.log(f'doc_snd : {message.document.file_name}')
+        sent.add_done_callback(self.send_done("doc_snd", message.document.file_name))
 
     def send_vid(self, message):
         self.log(f"vid_rcv : {message.video.file_name}")
-        self.bot.send_video(
+        sent = self.sender.submit(
+            message.chat.id,
+            "send_video",
             message.chat.id,
             message.video.file_id,
         )
-        self.log(f'vid_snd : {message.video.file_name}')
-
-    def save_data(self, message):
+        sent.add_done_callback(self.send_done("vid_snd", message.video.file_name))
+
+    def send_done(self, tag, file_name):
+        # sends finish on the scheduler's threads, log them when they do
+        def log_sent(sent):
+            if sent.exception() is not None:
+                self.log(f"snd_err : {sent.exception()} : {file_name}")
+            else:
+                self.log(f"{tag} : {file_name}")
+        return log_sent
+
+    @staticmethod
+    def file_name_of(file):
+        # telegram leaves file_name out of many documents and videos, name is NOT NULL
+        if file.file_name:
+            return file.file_name
+        extension = mimetypes.guess_extension(getattr(file, "mime_type", None) or "") or ""
+        return f"{file.file_unique_id}{extension}"
+
+    def file_data(self, message):
         col_data = {}
         if message.content_type == "document":
-            col_data["name"] = message.document.file_name
+            col_data["name"] = self.file_name_of(message.document)
             col_data["file_id"] = message.document.file_id
             col_data["file_uid"] = message.document.file_unique_id
         if message.content_type == "video":
-            col_data["name"] = message.video.file_name
+            col_data["name"] = self.file_name_of(message.video)
             col_data["file_id"] = message.video.file_id
             col_data["file_uid"] = message.video.file_unique_id
         col_data["file_type"] = message.content_type
+        return col_data
 
-        file_ids = self.db.db_fetch_col(col_names=["file_uid"])
-        if col_data["file_uid"] not in file_ids:
-            self.db.db_insert(col_data)
-            self.log(f"dta_svd: name: {col_data['name']}")
+    def save_data(self, messages, wait: bool = False):
+        """
+        wait : with the write-behind queue, return once the files are written
+        """
+        files = [self.file_data(message) for message in messages]
+        if self.writer is not None:
+            # written in the background, data_saved runs once the batch is in the database
+            self.writer.put_many(files)
+            if wait:
+                self.writer.flush()
+            return
+        self.data_saved(files, self.db.db_insert_many(files, conflict_cols=["file_uid"]))
+
+    def data_saved(self, files, ids):
+        if self.index is None:
+            self.log(f"dta_svd: {len(ids)} of {len(files)} files")
+            return
+        for col_data in files:
+            if self.index.add(col_data["name"], col_data["file_uid"]):
+                self.log(f"dta_svd: name: {col_data['name']}")
 
     def search_data(self, message):
         file_name = message.text[8:].lower().split()
-        self.search_name_list = {}
-
-        files = self.db.db_fetch_all()
-        for data in files:
-            count = 0
-            for name in file_name:
-                if any(name in data["name"].lower().split(separator) for separator in ['.', '_', ' ']):
-                    count += 1
-            if len(file_name) == count:
-                self.search_name_list[data["name"]] = data["file_uid"]
-
         self.bot.delete_message(message.chat.id, message.id)
+
+        if self.index is None:
+            # pages are fetched from the database one at a time
+            self.search_sessions.set(message.chat.id, file_name)
+            self.display_db_search_data(message.chat.id)
+            return
+
+        results = self.index.search(file_name)
+        fuzzy = False
+        if not results and settings.SEARCH_FUZZY:
+            # nothing matches exactly, try names spelled close to the terms
+            results = self.index.fuzzy_search(
+                file_name,
+                threshold=settings.SEARCH_FUZZY_THRESHOLD,
+                limit=settings.SEARCH_FUZZY_LIMIT,
+            )
+            fuzzy = bool(results)
+        self.search_sessions.set(
+            message.chat.id,
+            SearchSession(results, settings.SEARCH_PAGE_SIZE, self.build_search_page, fuzzy=fuzzy),
+        )
         self.display_search_data(message.chat.id, 0)
 
-    def display_search_data(self, message_id, page):
+    def search_page_markup(self, files, next_data=None, back_data=None):
         markup = types.InlineKeyboardMarkup()
-        ln = 0
-        temp_lst = []
-
-        while ln < len(self.search_name_list):
-            lst = dict(list(self.search_name_list.items())[ln:ln + 10])
-            temp_lst.append(lst)
-            ln += 10
-        if len(self.search_name_list) != 0:
-            for name, uid in temp_lst[page].items():
-                btn = types.InlineKeyboardButton(
-                    name,
-                    callback_data=f"search#{uid}",
-                )
-                temp_lst.append(name)
-                markup.add(btn)
-
-        if len(self.search_name_list) > 10:
-            next_btn = types.InlineKeyboardButton(
-                "Next",
-                callback_data=f"next#{page}",
+        for name, uid in files:
+            btn = types.InlineKeyboardButton(
+                name,
+                callback_data=f"search#{uid}",
             )
+            markup.add(btn)
 
-            back_btn = types.InlineKeyboardButton(
+        nav_btns = []
+        if back_data is not None:
+            nav_btns.append(types.InlineKeyboardButton(
                 "Back",
-                callback_data=f"back#{page}",
-            )
-            markup.add(back_btn, next_btn, row_width=2)
+                callback_data=back_data,
+            ))
+        if next_data is not None:
+            nav_btns.append(types.InlineKeyboardButton(
+                "Next",
+                callback_data=next_data,
+            ))
+        if nav_btns:
+            markup.add(*nav_btns, row_width=2)
         done_btn = types.InlineKeyboardButton(
             "Done",
             callback_data="done"
         )
         markup.add(done_btn)
-        if len(self.search_name_list) == 0:
+        return markup
+
+    def build_search_page(self, files, page, page_count):
+        if page_count > 1:
+            return self.search_page_markup(files, f"next#{page}", f"back#{page}")
+        return self.search_page_markup(files)
+
+    def search_expired(self, chat_id):
+        self.bot.send_message(
+            chat_id,
+            "search expired, use /search again",
+        )
+
+    def display_db_search_data(self, chat_id, after=None, before=None):
+        terms = self.search_sessions.get(chat_id)
+        if terms is None:
+            self.search_expired(chat_id)
+            return
+
+        page = self.db.db_fetch_page(
+            after=after,
+            before=before,
+            limit=settings.SEARCH_PAGE_SIZE,
+            order_by="rank",
+            col_names=["name", "file_uid"],
+            search_terms=terms,
+            search_col="name",
+        )
+        markup = self.search_page_markup(
+            [(data["name"], data["file_uid"]) for data in page.rows],
+            f"next#{page.next}" if page.next else None,
+            f"back#{page.prev}" if page.prev else None,
+        )
+        if len(page.rows) == 0:
             txt = "MATCH NOT FOUND"
         else:
             txt = "MATCH FOUND"
         self.bot.send_message(
-            message_id,
+            chat_id,
             txt,
             reply_markup=markup,
         )
 
+    def display_search_data(self, chat_id, page):
+        session = self.search_sessions.get(chat_id)
+        if session is None:
+            self.search_expired(chat_id)
+            return
+
+        if len(session) == 0:
+            txt = "MATCH NOT FOUND"
+        elif session.fuzzy:
+            txt = "NO EXACT MATCH, SIMILAR NAMES FOUND"
+        else:
+            txt = "MATCH FOUND"
+        self.bot.send_message(
+            chat_id,
+            txt,
+            reply_markup=session.page(page),
+        )
+
     def ftr_btn_call_handle(self, call):
         self.bot.delete_message(
             call.from_user.id,
             call.message.id,
         )
-        for chat_id, messages in self.messages_dict.items():
-            if call.from_user.id == chat_id:
-                for message in messages:
-                    if message.content_type == "document":
-                        self.send_doc(message)
-                    if message.content_type == "video":
-                        self.send_vid(message)
-        self.messages_dict.__delitem__(call.from_user.id)
+        for message in self.messages_dict.pop(call.from_user.id, []):
+            if message.content_type == "document":
+                self.send_doc(message)
+            if message.content_type == "video":
+                self.send_vid(message)
+
+    def page_token(self, call):
+        """
+        Returns the page token of a next / back button, None if it is stale or malformed
+        """
+        token = call.data.split("#")[-1]
+        try:
+            return decode_page_token(token) if self.index is None else int(token)
+        except ValueError:
+            return None
 
     def nxt_btn_call_handle(self, call):
 
@@ -281,7 +592,14 @@ class Bot():
             call.from_user.id,
             call.message.id,
         )
-        page = int(call.data.split("#")[-1]) + 1
+        token = self.page_token(call)
+        if token is None:
+            self.search_expired(call.from_user.id)
+            return
+        if self.index is None:
+            self.display_db_search_data(call.from_user.id, after=call.data.split("#")[-1])
+            return
+        page = token + 1
         self.display_search_data(
             call.from_user.id,
             page,
@@ -289,7 +607,7 @@ class Bot():
 
     def done_btn_call_handle(self, call):
 
-        self.messages_dict = {}
+        self.messages_dict.pop(call.from_user.id, None)
         self.bot.delete_message(
             call.from_user.id,
             call.message.id
@@ -301,7 +619,14 @@ class Bot():
             call.from_user.id,
             call.message.id,
         )
-        page = int(call.data.split("#")[-1]) - 1
+        token = self.page_token(call)
+        if token is None:
+            self.search_expired(call.from_user.id)
+            return
+        if self.index is None:
+            self.display_db_search_data(call.from_user.id, before=call.data.split("#")[-1])
+            return
+        page = token - 1
         self.display_search_data(
             call.from_user.id,
             page,
@@ -329,4 +654,37 @@ class Bot():
 
 
 if __name__ == "__main__":
-    Bot()
+    if settings.RUN_MODE == "processes":
+        from workers import ProcessRunner
+
+        ProcessRunner(
+            workers=settings.PROCESS_WORKERS,
+            queue_size=settings.PROCESS_QUEUE_SIZE,
+            api_url=settings.TELEGRAM_API_URL,
+            refresh_interval=settings.INDEX_REFRESH_INTERVAL,
+            resync_interval=settings.INDEX_RESYNC_INTERVAL,
+        ).run(
+            settings.API_KEY,
+            ingest=settings.PROCESS_INGEST,
+            url=settings.WEBHOOK_URL,
+            host=settings.WEBHOOK_HOST,
+            port=settings.WEBHOOK_PORT,
+            path=settings.WEBHOOK_PATH,
+            secret=settings.WEBHOOK_SECRET,
+        )
+    else:
+        import signal
+
+        def terminate(signum, frame):
+            # heroku stops the dyno with SIGTERM, unwind like Ctrl-C so the bot is closed
+            raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, terminate)
+        bot = Bot(run=False)
+        try:
+            bot.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # writes the write-behind queue and finishes the queued sends
+            bot.close()
@@ -1,11 +1,16 @@
-from .dbman import DBMan
+from .dbman import DBMan, close_pools
+from .writer import WriteBehindQueue, QueueFullError
+from .stats import query_stats
 from .meta import DBMAN
+from .queryset import QuerySet
 from .fields import (
     CharField,
     VarCharField,
     TextField,
     IntField,
-    FloatField
+    FloatField,
+    RowCodec,
+    SizeError,
     )
 
 db_engine = "engine"
\ No newline at end of file
@@ -0,0 +1,143 @@
+###################################################
+# DBMan row cache
+# Author      : Adeeb
+# Version     : 1.0
+# Description : identity map and LRU cache of model instances
+###################################################
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from weakref import WeakValueDictionary
+
+
+class RowCache:
+    """
+    Identity map plus LRU cache of model instances, keyed by id and unique columns
+
+    - every live instance loaded through the manager is kept in the identity map,
+      so two lookups of the same row return the same object
+    - the max_size most recently used instances are also kept alive by the LRU
+    - an entry older than ttl seconds is reloaded from the database (ttl=0 disables it)
+
+    Parameters
+    ----------
+    max_size : maximum number of instances kept by the LRU
+    ttl : seconds an entry is trusted after it was loaded or saved
+    unique_cols : columns, besides id, which identify a single row
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 300, unique_cols: list[str] = ()):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.unique_cols = tuple(unique_cols)
+        self.hits = 0
+        self.misses = 0
+
+        self._lru = OrderedDict()
+        self._identity = WeakValueDictionary()
+        self._stamps = {}
+        self._keys = {}
+        self._unique = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._lru)
+
+    def _expired_(self, pk, now):
+        return self.ttl and now - self._stamps.get(pk, 0) > self.ttl
+
+    def _drop_(self, pk):
+        self._lru.pop(pk, None)
+        self._identity.pop(pk, None)
+        self._stamps.pop(pk, None)
+        for key in self._keys.pop(pk, ()):
+            self._unique.pop(key, None)
+
+    def _lookup_(self, pk, now):
+        if pk is None or self._expired_(pk, now):
+            return None
+        obj = self._identity.get(pk)
+        if obj is None:
+            return None
+        self._lru[pk] = obj
+        self._lru.move_to_end(pk)
+        return obj
+
+    def get(self, col_name: str, value):
+        """
+        Return the cached instance whose col_name equals value, or None (counted as a miss)
+        """
+        now = monotonic()
+        with self._lock:
+            pk = value if col_name == "id" else self._unique.get((col_name, value))
+            obj = self._lookup_(pk, now)
+            if obj is None:
+                if pk is not None:
+                    self._drop_(pk)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return obj
+
+    def put(self, obj):
+        """
+        Cache an instance which was just loaded or saved
+        """
+        pk = obj.id
+        if pk is None:
+            return
+        with self._lock:
+            self._drop_(pk)
+            self._identity[pk] = obj
+            self._lru[pk] = obj
+            self._stamps[pk] = monotonic()
+            keys = [(col, getattr(obj, col)) for col in self.unique_cols]
+            self._keys[pk] = keys
+            for key in keys:
+                self._unique[key] = pk
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+            if len(self._stamps) > 2 * self.max_size:
+                # forget rows whose instances were evicted and garbage collected
+                for stale in [pk for pk in self._stamps if pk not in self._identity]:
+                    self._drop_(stale)
+
+    def identity(self, pk):
+        """
+        Return the live instance of a row if one exists, without counting a hit or miss
+        """
+        with self._lock:
+            return self._identity.get(pk)
+
+    def invalidate_by(self, col_name: str, value):
+        """
+        Forget the row whose col_name equals value
+        """
+        with self._lock:
+            pk = value if col_name == "id" else self._unique.get((col_name, value))
+            if pk is not None:
+                self._drop_(pk)
+
+    def invalidate(self, pk=None):
+        """
+        Forget one row, or every row when pk is None
+        """
+        with self._lock:
+            if pk is None:
+                self._lru.clear()
+                self._identity = WeakValueDictionary()
+                self._stamps.clear()
+                self._keys.clear()
+                self._unique.clear()
+            else:
+                self._drop_(pk)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._lru),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
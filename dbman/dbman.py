@@ -7,9 +7,27 @@
 
 import sqlite3
 import psycopg2
-from os import path
+from psycopg2.extras import execute_values
+from collections import namedtuple
+from functools import lru_cache
+from os import path, getpid
+from threading import Lock
+from time import perf_counter
+from uuid import uuid4
 
 from .fields import PrimaryKeyField
+from .pool import ConnectionPool
+from .schema import SchemaCache, TableSchema
+from .stats import query_stats
+from .query import (
+    compile_select,
+    compile_insert,
+    compile_insert_many,
+    compile_update,
+    compile_delete,
+    compile_text_search,
+    compile_page,
+    )
 
 
 # ============== Exception Handling ============= #
@@ -57,19 +75,63 @@ class DataNotFoundError(Exception):
 
 # =============================================== #
 
+_pools = {}
+_pools_lock = Lock()
+_schemas = SchemaCache()
+_unique_indexes = set()
+
+
+def close_pools():
+    """
+    Close every connection pool opened by DBMan
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
 class DBInit:
     """
     - CLass which deal with initial processes
     - Include common methods
+
+    DB_CONFIG may also set the connection pool:
+    POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_MAX_LIFETIME (seconds), POOL_TIMEOUT (seconds), POOL_HEALTH_CHECK
+
+    and SLOW_QUERY_MS, statements slower than it are logged (dbman.query_stats)
     """
     DB_ENGINE = "sqlite"
     DB_CONFIG = {"NAME": "database.sqlite"}
     table_name = None
 
+    def _get_pool_(self):
+        # keyed by pid too, a forked process never uses the connections of its parent
+        key = (getpid(), self.DB_ENGINE, tuple(sorted(self.DB_CONFIG.items())))
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(
+                    self._connect_,
+                    min_size=int(self.DB_CONFIG.get("POOL_MIN_SIZE", 1)),
+                    max_size=int(self.DB_CONFIG.get("POOL_MAX_SIZE", 5)),
+                    max_lifetime=float(self.DB_CONFIG.get("POOL_MAX_LIFETIME", 3600)),
+                    timeout=float(self.DB_CONFIG.get("POOL_TIMEOUT", 30)),
+                    health_check=bool(self.DB_CONFIG.get("POOL_HEALTH_CHECK", True)),
+                )
+                _pools[key] = pool
+            return pool
+
     def _get_connection_(self):
+        """
+        Check out a pooled connection, use as 'with self._get_connection_() as conn'
+        """
+        return self._get_pool_().connection()
+
+    def _connect_(self):
         database = self.DB_CONFIG["NAME"]
         if self.DB_ENGINE == "sqlite":
-            return sqlite3.connect(database)
+            return sqlite3.connect(database, check_same_thread=False)
 
         if self.DB_ENGINE in ("psql", "postgresql", "postgres"):
             host = self.DB_CONFIG.get("HOST", "127.0.0.1")
@@ -79,37 +141,165 @@ class DBInit:
             connection = psycopg2.connect(database=database, host=host, port=port, user=username, password=password)
             return connection
 
+        raise ValueError(f"unsupported DB_ENGINE: '{self.DB_ENGINE}'")
+
+    def _slow_threshold_(self):
+        return float(self.DB_CONFIG.get("SLOW_QUERY_MS", 500)) / 1000
+
+    def _measure_(self, query: str):
+        """
+        Time a statement into query_stats, use as 'with self._measure_(query) as measure'
+        """
+        return query_stats.measure(query, self._slow_threshold_())
+
     def _db_read_(self, query: str, params: tuple = ()):
         """
         To read from the database
         """
-        with self._get_connection_() as conn:
+        with self._measure_(query) as measure, self._get_connection_() as conn:
             cur = conn.cursor()
             cur.execute(query, params)
             data = cur.fetchall()
             cur.close()
+            measure.rows = len(data)
             return data
 
     def _db_write_(self, query: str, params: tuple = ()):
         """
-        To write into database
+        To write into database, returns the number of affected rows
         """
-        with self._get_connection_() as conn:
+        with self._measure_(query) as measure, self._get_connection_() as conn:
+            cur = conn.cursor()
+            cur.execute(query, params)
+            conn.commit()
+            rowcount = cur.rowcount
+            cur.close()
+            measure.rows = max(rowcount, 0)
+            return rowcount
+
+    def _is_psql_(self):
+        return self.DB_ENGINE in ("psql", "postgresql", "postgres")
+
+    def _placeholder_(self):
+        return "%s" if self._is_psql_() else "?"
+
+    def _schema_key_(self):
+        return (self.DB_ENGINE, self.DB_CONFIG.get("NAME"), self.DB_CONFIG.get("HOST"), self.table_name.lower())
+
+    def _load_schema_(self):
+        """
+        Read column names and types from the catalog, without touching table rows
+        """
+        if self._is_psql_():
+            query = (
+                "SELECT column_name, data_type FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = %s ORDER BY ordinal_position"
+            )
+            rows = self._db_read_(query, (self.table_name.lower(),))
+        else:
+            rows = [(row[1], row[2]) for row in self._db_read_(f"PRAGMA table_info({self.table_name})")]
+
+        return TableSchema(tuple(name for name, _ in rows), {name: data_type for name, data_type in rows})
+
+    def _get_schema_(self):
+        key = self._schema_key_()
+        schema = _schemas.get(key)
+        if schema is None:
+            schema = self._load_schema_()
+            if schema.columns:
+                _schemas.set(key, schema)
+        return schema
+
+    def _invalidate_schema_(self):
+        _schemas.invalidate(self._schema_key_())
+
+    def _has_id_(self):
+        # tables created with pk=False have no id column to return
+        return "id" in self._get_schema_().columns
+
+    def _db_insert_id_(self, query: str, params: tuple = (), returning: bool = True):
+        """
+        To insert one row, returns its id (RETURNING id on psql, cursor.lastrowid on sqlite),
+        None on psql when the query returns nothing
+        """
+        with self._measure_(query) as measure, self._get_connection_() as conn:
             cur = conn.cursor()
             cur.execute(query, params)
+            if self._is_psql_():
+                row_id = cur.fetchone()[0] if returning else None
+            else:
+                row_id = cur.lastrowid
+            measure.rows = 1
             conn.commit()
             cur.close()
+            return row_id
+
+    def _db_stream_(self, query: str, params: tuple = (), batch_size: int = 1000):
+        """
+        To read from the database lazily, fetching batch_size rows at a time
+
+        Uses a named (server side) cursor on psql, the connection stays checked out
+        until the generator is exhausted or closed
+
+        Only the time spent in the database is recorded, not the time the caller
+        spends between batches
+        """
+        elapsed = 0
+        count = 0
+        error = True
+        with self._get_connection_() as conn:
+            if self._is_psql_():
+                cur = conn.cursor(name=f"dbman_{uuid4().hex}")
+                cur.itersize = batch_size
+            else:
+                cur = conn.cursor()
+            try:
+                start = perf_counter()
+                cur.execute(query, params)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    elapsed += perf_counter() - start
+                    if not rows:
+                        break
+                    count += len(rows)
+                    yield from rows
+                    start = perf_counter()
+                error = False
+            except GeneratorExit:
+                # closed early by the caller
+                error = False
+                raise
+            finally:
+                cur.close()
+                query_stats.record(query, elapsed, count, error=error, slow_threshold=self._slow_threshold_())
 
     def _get_col_names_(self):
-        query = {
-                "sqlite": f"SELECT * FROM {self.table_name}"
-                }
-        with self._get_connection_() as db:
-            cur = db.cursor()
-            cur.execute(f"SELECT * FROM {self.table_name}")
-            col_names = [description[0] for description in cur.description]
-            
-            return col_names
+        return list(self._get_schema_().columns)
+
+    def _get_col_types_(self):
+        return dict(self._get_schema_().types)
+
+    def _get_table_names_(self):
+        if self._is_psql_():
+            query = "SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()"
+        else:
+            query = "SELECT name FROM sqlite_master WHERE type = 'table'"
+        return [row[0] for row in self._db_read_(query)]
+
+    def db_schema(self):
+        """
+        Return the cached TableSchema (columns, types) of the table
+        """
+        return self._get_schema_()
+
+    def _get_index_names_(self):
+        if self._is_psql_():
+            query = "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s"
+            return [row[0] for row in self._db_read_(query, (self.table_name.lower(),))]
+        return [row[1] for row in self._db_read_(f"PRAGMA index_list({self.table_name})")]
+
+    def _index_name_(self, col_names: list[str], unique: bool = False):
+        return f"{self.table_name}_{'_'.join(col_names)}_{'key' if unique else 'idx'}".lower()
 
     def _check_col_name_(self, col_name: str, col_list: list=[]):
         if col_name in col_list:
@@ -121,19 +311,50 @@ class DBInit:
         return True
 
     def _check_col_exists_(self, col_name: str):
-        col_names = self._get_col_names_()
         if col_name == "*":
             return True
 
-        if col_name not in col_names:
+        if col_name not in self._get_schema_():
             raise ColumnNotFoundError(f"column not found: '{col_name}'")
         return True
 
 
+@lru_cache(maxsize=128)
+def _row_class_(col_names: tuple):
+    return namedtuple("Row", col_names)
+
+
+Page = namedtuple("Page", ["rows", "next", "prev"])
+
+_TOKEN_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def encode_page_token(row_id: int):
+    """
+    id -> short base36 continuation token (fits in telegram callback_data)
+    """
+    if row_id < 0:
+        return "-" + encode_page_token(-row_id)
+    token = ""
+    while True:
+        row_id, digit = divmod(row_id, 36)
+        token = _TOKEN_DIGITS[digit] + token
+        if not row_id:
+            return token
+
+
+def decode_page_token(token: str):
+    try:
+        return int(token, 36)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid page token: '{token}'")
+
+
 class DBRead(DBInit):
     """
     Class which deals with reading data from the database
     """
+    ROW_TYPES = ("dict", "tuple", "namedtuple")
 
     @staticmethod
     def _data_to_list_(data: list[tuple]):
@@ -142,45 +363,163 @@ class DBRead(DBInit):
         """
         return [x[0] for x in data]
 
-    def _data_to_dict_(self, data: list[tuple]):
+    def _data_to_dict_(self, data: list[tuple], col_names: list[str] = None):
         """
         list[tuple] -> tuple[dict(column_name: value)]
         """
-        col_names = self._get_col_names_()
-        clean_data = [dict(zip(col_names, col_data)) for col_data in data]        
+        if col_names is None or "*" in col_names:
+            col_names = self._get_col_names_()
+        clean_data = [dict(zip(col_names, col_data)) for col_data in data]
         return clean_data
 
-    def _get_query_(self, column_names: list[str] = ["*"], row_ids: dict = None, order_by: list[str] = None, desc: bool = False):
-        columns = ", ".join([col for col in column_names if self._check_col_exists_(col)])
-        query = f"SELECT {columns} FROM {self.table_name}"
-        if row_ids is not None:
-            conditions = ", ".join([f"{col}='{val}'" for col, val in row_ids.items() if self._check_col_exists_(col)])
-            query += f" WHERE {conditions}"
+    def _get_query_(self, column_names: list[str] = ["*"], row_ids: dict = None, order_by: list[str] = None, desc: bool = False, limit: int = None):
+        """
+        Returns (query, params) of a SELECT
+        """
+        for col in column_names:
+            self._check_col_exists_(col)
+        for col in row_ids or ():
+            self._check_col_exists_(col)
+
+        return compile_select(
+            self.table_name,
+            columns=column_names,
+            conditions=row_ids,
+            order_by=order_by,
+            desc=desc,
+            limit=limit,
+            placeholder=self._placeholder_(),
+        )
+
+    def db_iter_rows(self, col_names: list = ["*"], order_by: list[str] = None, desc: bool = False,
+                     batch_size: int = 1000, row_type: str = "dict", **conditions):
+        """
+        Generator over the matching rows, streamed in batches of batch_size
+
+        Parameters
+        ----------
+        row_type : "dict", "tuple" or "namedtuple"
+        """
+        if row_type not in self.ROW_TYPES:
+            raise ValueError(f"row_type must be one of {self.ROW_TYPES}")
+
+        query, params = self._get_query_(column_names = col_names, row_ids = conditions, order_by = order_by, desc = desc)
+        names = self._get_col_names_() if "*" in col_names else list(col_names)
+        rows = self._db_stream_(query, params, batch_size=batch_size)
+        try:
+            if row_type == "tuple":
+                yield from rows
+            elif row_type == "namedtuple":
+                yield from map(_row_class_(tuple(names))._make, rows)
+            else:
+                yield from (dict(zip(names, row)) for row in rows)
+        finally:
+            rows.close()
+
+    def db_iter_all(self, order_by: list[str] = None, desc: bool = False, batch_size: int = 1000, row_type: str = "dict"):
+        """
+        Generator over every row of the table, streamed in batches of batch_size
+        """
+        yield from self.db_iter_rows(order_by=order_by, desc=desc, batch_size=batch_size, row_type=row_type)
+
+    def db_search_text(self, terms: list[str], col_name: str = "name", col_names: list = ["*"], limit: int = 50):
+        """
+        Ranked full text search over col_name, needs db_create_fts(col_name) first
 
-        if order_by is not None:
-            order_by_cols = ", ".join(order_by)
-            query += f" ORDER BY {order_by_cols}"
-            if desc:
-                query += " DESC"
+        Parameters
+        ----------
+        terms : every term must match, terms are split on '.', '_' and ' ' like the indexed text
+        limit : maximum number of rows returned, best match first
+        """
+        terms = [term for term in terms if term.strip()]
+        if not terms:
+            return []
+        self._check_col_exists_(col_name)
+        for col in col_names:
+            self._check_col_exists_(col)
 
-        return query
+        query, params = compile_text_search(self.table_name, col_name, terms, columns=col_names, limit=limit, psql=self._is_psql_())
+        query_data = self._db_read_(query, params)
+        return self._data_to_dict_(data=query_data, col_names=col_names)
+
+    def db_fetch_page(self, after: str = None, before: str = None, limit: int = 10, order_by: str = "id",
+                      desc: bool = False, col_names: list = ["*"], search_terms: list[str] = None,
+                      search_col: str = "name", **conditions):
+        """
+        Keyset (seek) pagination, ordered by order_by then id
 
-    def db_fetch_all(self, order_by: list[str] = None, desc: bool = False):
-        query = self._get_query_(order_by = order_by, desc = desc)
-        query_data = self._db_read_(query)
+        Parameters
+        ----------
+        after : token of the row after which the page starts (Page.next of the previous page)
+        before : token of the row before which the page ends (Page.prev of the next page)
+        limit : rows per page
+        order_by : indexed column to page through, ties are broken by id,
+                   or "rank" for the full text rank of search_terms, best match first
+        search_terms : (optional) only rows matching every term in the full text index of search_col
+        conditions : where conditions (column_name = value)
+
+        Returns Page(rows, next, prev), next / prev are None at either end of the results
+        """
+        if after is not None and before is not None:
+            raise ValueError("pass either after or before, not both")
+        if order_by == "rank":
+            if not search_terms:
+                raise ValueError("order_by 'rank' needs search_terms")
+            if "*" in col_names:
+                # the ranked rows are selected from a subquery, which also has the rank column
+                col_names = self._get_col_names_()
+        else:
+            self._check_col_exists_(order_by)
+        for col in conditions:
+            self._check_col_exists_(col)
+        if "*" not in col_names:
+            col_names = list(col_names) + [col for col in ("id",) if col not in col_names]
+            for col in col_names:
+                self._check_col_exists_(col)
+
+        token = after if after is not None else before
+        query, params = compile_page(
+            self.table_name,
+            columns=col_names,
+            conditions=conditions,
+            key_col=order_by,
+            seek_id=decode_page_token(token) if token is not None else None,
+            backward=before is not None,
+            desc=desc,
+            search_col=search_col,
+            search_terms=search_terms,
+            limit=limit + 1,
+            psql=self._is_psql_(),
+        )
+        rows = self._data_to_dict_(data=self._db_read_(query, params), col_names=col_names)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        if before is not None:
+            rows.reverse()
+            next_token = encode_page_token(rows[-1]["id"]) if rows else before
+            prev_token = encode_page_token(rows[0]["id"]) if has_more else None
+        else:
+            next_token = encode_page_token(rows[-1]["id"]) if has_more else None
+            prev_token = encode_page_token(rows[0]["id"]) if after is not None and rows else None
+        return Page(rows, next_token, prev_token)
+
+    def db_fetch_all(self, order_by: list[str] = None, desc: bool = False, limit: int = None):
+        query, params = self._get_query_(order_by = order_by, desc = desc, limit = limit)
+        query_data = self._db_read_(query, params)
         return self._data_to_dict_(data=query_data)
 
-    def db_fetch_col(self, col_names: list[str], order_by: list[str] = None, desc: bool = False):
-        query = self._get_query_(column_names = col_names, order_by = order_by, desc = desc)
-        query_data = self._db_read_(query)
+    def db_fetch_col(self, col_names: list[str], order_by: list[str] = None, desc: bool = False, limit: int = None):
+        query, params = self._get_query_(column_names = col_names, order_by = order_by, desc = desc, limit = limit)
+        query_data = self._db_read_(query, params)
         return DBRead._data_to_list_(query_data)
 
-    def db_fetch_row(self, col_names: list = ["*"], order_by: list[str] = None, desc: bool = False, **conditions):
-        query = self._get_query_(column_names = col_names, row_ids = conditions, order_by = order_by, desc = desc)
-        query_data = self._db_read_(query)
+    def db_fetch_row(self, col_names: list = ["*"], order_by: list[str] = None, desc: bool = False, limit: int = None, **conditions):
+        query, params = self._get_query_(column_names = col_names, row_ids = conditions, order_by = order_by, desc = desc, limit = limit)
+        query_data = self._db_read_(query, params)
         if not query_data:
             raise DataNotFoundError(f"value not found: database returned empty list")
-        return self._data_to_dict_(data=query_data)
+        return self._data_to_dict_(data=query_data, col_names=col_names)
 
 
 class DBWrite(DBInit):
@@ -195,23 +534,237 @@ class DBWrite(DBInit):
         col_descriptions  : dict[column name (str): column data type (dbman.Field)]
         pk : (optional) create a primary key column with name 'id'
         """
-        col_details = ", ".join([f"{col_name} {data_type.get_query()}" for col_name, data_type in col_descriptions.items() if self._check_col_name_(col_name)])
+        col_list = []
+        col_details = ", ".join([f"{col_name} {data_type.get_query()}" for col_name, data_type in col_descriptions.items() if self._check_col_name_(col_name, col_list)])
         if pk:
             pk_col = PrimaryKeyField(self.DB_ENGINE)
             col_details = f"{pk_col.get_query()}, {col_details}"
         query = f"CREATE TABLE IF NOT EXISTS {self.table_name} ({col_details})"
         self._db_write_(query)
+        self._invalidate_schema_()
 
     def db_insert(self, data: dict = None):
         """
         Parameters
         ----------
         data : dict[column name: value]
+
+        Returns the id the database assigned to the row, None on psql for a table without an id column
+        """
+        returning = self._is_psql_() and self._has_id_()
+        query, params = compile_insert(
+            self.table_name,
+            data,
+            placeholder=self._placeholder_(),
+            returning="id" if returning else None,
+        )
+        return self._db_insert_id_(query, params, returning)
+
+    def _ensure_unique_index_(self, col_names: list[str]):
+        """
+        Create the UNIQUE index needed by 'ON CONFLICT (col_names)', once per process
+        """
+        key = (self._schema_key_(), tuple(col_names))
+        if key in _unique_indexes or tuple(col_names) == ("id",):
+            return
+        self.db_create_index(col_names, unique=True)
+
+    def db_delete_duplicates(self, col_names: list[str]):
+        """
+        Delete the rows repeating the col_names values of an earlier row, the lowest id is kept
+
+        Rows with a NULL in col_names are never duplicates, as for a UNIQUE index
+
+        Returns the number of deleted rows
+        """
+        for col in col_names:
+            self._check_col_exists_(col)
+        cols = ", ".join(col_names)
+        not_null = " AND ".join(f"{col} IS NOT NULL" for col in col_names)
+        query = (
+            f"DELETE FROM {self.table_name} WHERE {not_null} "
+            f"AND id NOT IN (SELECT MIN(id) FROM {self.table_name} GROUP BY {cols})"
+        )
+        return max(self._db_write_(query), 0)
+
+    def db_create_index(self, col_names: list[str], unique: bool = False, index_name: str = None,
+                        drop_duplicates: bool = False):
+        """
+        Create an index on col_names, does nothing if an index with that name exists
+
+        Parameters
+        ----------
+        col_names : columns of the index, in order
+        unique : (optional) create a UNIQUE index
+        index_name : (optional) defaults to '<table>_<columns>_idx' ('_key' when unique)
+        drop_duplicates : (optional) before creating a UNIQUE index, delete the rows it would reject
+                          (db_delete_duplicates), otherwise existing duplicates make it fail
+
+        Returns the index name
         """
-        cols = ', '.join([f"{col}" for col in data])
-        values = ', '.join([f"'{value}'" for value in data.values()])
-        query = f"INSERT INTO {self.table_name} ({cols}) VALUES ({values})"
+        for col in col_names:
+            self._check_col_exists_(col)
+        index_name = index_name or self._index_name_(col_names, unique)
+        if unique and drop_duplicates and index_name.lower() not in [name.lower() for name in self._get_index_names_()]:
+            deleted = self.db_delete_duplicates(col_names)
+            if deleted:
+                print(f"{deleted} duplicate rows deleted from {self.table_name} before creating {index_name}")
+        unique_sql = "UNIQUE " if unique else ""
+        query = f"CREATE {unique_sql}INDEX IF NOT EXISTS {index_name} ON {self.table_name} ({', '.join(col_names)})"
         self._db_write_(query)
+        if unique:
+            _unique_indexes.add((self._schema_key_(), tuple(col_names)))
+        return index_name
+
+    def db_drop_index(self, col_names: list[str] = None, unique: bool = False, index_name: str = None):
+        """
+        Drop the index named index_name, or the one db_create_index made on col_names
+        """
+        if index_name is None:
+            if not col_names:
+                raise ValueError("col_names or index_name is required")
+            index_name = self._index_name_(col_names, unique)
+        self._db_write_(f"DROP INDEX IF EXISTS {index_name}")
+
+        # the unique index may be the one ON CONFLICT relied on, check again next time
+        schema_key = self._schema_key_()
+        for key in [key for key in _unique_indexes if key[0] == schema_key]:
+            if index_name == self._index_name_(key[1], unique=True):
+                _unique_indexes.discard(key)
+
+    def db_upsert(self, data: dict, conflict_cols: list[str], update_cols: list[str] = None):
+        """
+        Insert a row, or resolve a conflict on conflict_cols in the same statement
+
+        Parameters
+        ----------
+        data : dict[column name: value]
+        conflict_cols : columns backed by a UNIQUE index (created if missing)
+        update_cols : (optional) columns to overwrite on conflict, the row is left untouched if None
+
+        Returns True if a row was inserted or updated
+        """
+        self._ensure_unique_index_(conflict_cols)
+        query, params = compile_insert(
+            self.table_name,
+            data,
+            placeholder=self._placeholder_(),
+            conflict_cols=conflict_cols,
+            update_cols=update_cols,
+        )
+        return self._db_write_(query, params) > 0
+
+    def db_insert_or_ignore(self, data: dict, conflict_cols: list[str]):
+        """
+        Insert a row unless a row with the same conflict_cols values exists
+
+        Returns True if the row was inserted
+        """
+        return self.db_upsert(data, conflict_cols)
+
+    def db_insert_many(self, rows: list[dict], chunk_size: int = 500, conflict_cols: list[str] = None,
+                       col_names: list[str] = None):
+        """
+        Insert many rows in a single transaction
+
+        Parameters
+        ----------
+        rows : list[dict[column name: value]], every row must have the same columns
+        chunk_size : number of rows sent to the database per batch
+        conflict_cols : (optional) skip rows which conflict on these columns (UNIQUE index created if missing)
+        col_names : (optional) rows are already tuples of these columns, e.g. from RowCodec.encode_many
+
+        Returns the ids of the inserted rows, None for each inserted row on psql
+        when the table has no id column
+        """
+        if not rows:
+            return []
+        if conflict_cols:
+            self._ensure_unique_index_(conflict_cols)
+
+        if col_names is not None:
+            cols = list(col_names)
+            values = rows
+        else:
+            cols = list(rows[0])
+            values = [tuple(row[col] for col in cols) for row in rows]
+        returning = self._is_psql_() and self._has_id_()
+        if self._is_psql_():
+            query = compile_insert_many(self.table_name, cols, conflict_cols=conflict_cols,
+                                        returning="id" if returning else None, batch=True)
+        else:
+            query = compile_insert_many(self.table_name, cols, placeholder="?", conflict_cols=conflict_cols)
+
+        ids = []
+        with self._measure_(query) as measure, self._get_connection_() as conn:
+            cur = conn.cursor()
+            for start in range(0, len(values), chunk_size):
+                chunk = values[start:start + chunk_size]
+                if returning:
+                    returned = execute_values(cur, query, chunk, page_size=chunk_size, fetch=True)
+                    ids.extend(row[0] for row in returned)
+                elif self._is_psql_():
+                    # one statement per chunk (page_size), so rowcount counts the whole chunk
+                    execute_values(cur, query, chunk, page_size=chunk_size)
+                    ids.extend([None] * cur.rowcount)
+                elif conflict_cols:
+                    # ignored rows leave gaps, so ids are read row by row (still one transaction)
+                    for row in chunk:
+                        cur.execute(query, row)
+                        if cur.rowcount == 1:
+                            ids.append(cur.lastrowid)
+                else:
+                    cur.executemany(query, chunk)
+                    last_id = cur.execute("SELECT last_insert_rowid()").fetchone()[0]
+                    ids.extend(range(last_id - len(chunk) + 1, last_id + 1))
+            cur.close()
+            measure.rows = len(ids)
+        return ids
+
+    def db_create_fts(self, col_name: str = "name"):
+        """
+        Create the full text index used by db_search_text, does nothing if it exists
+
+        - sqlite : external content FTS5 table '<table>_<col>_fts' kept in sync by triggers
+        - psql   : generated tsvector column '<col>_tsv' with a GIN index
+
+        Text is split on '.', '_' and white space, other punctuation such as '-' or '+'
+        stays inside the token on sqlite and follows the 'simple' parser on psql
+        """
+        self._check_col_exists_(col_name)
+        table = self.table_name
+
+        if self._is_psql_():
+            self._db_write_(
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {col_name}_tsv tsvector GENERATED ALWAYS AS "
+                f"(to_tsvector('simple', translate(lower(coalesce({col_name}, '')), '._', '  '))) STORED"
+            )
+            self._db_write_(f"CREATE INDEX IF NOT EXISTS {table}_{col_name}_tsv_idx ON {table} USING GIN ({col_name}_tsv)".lower())
+            self._invalidate_schema_()
+            return
+
+        fts_table = f"{table}_{col_name}_fts"
+        if fts_table.lower() in [name.lower() for name in self._get_table_names_()]:
+            return
+
+        tokenizer = "unicode61 separators '._' tokenchars '-+&!@#$%^~=,;()[]{}'"
+        self._db_write_(
+            f"CREATE VIRTUAL TABLE {fts_table} USING fts5({col_name}, content='{table}', content_rowid='id', tokenize=\"{tokenizer}\")"
+        )
+        self._db_write_(
+            f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts_table}(rowid, {col_name}) VALUES (new.id, new.{col_name}); END"
+        )
+        self._db_write_(
+            f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts_table}({fts_table}, rowid, {col_name}) VALUES ('delete', old.id, old.{col_name}); END"
+        )
+        self._db_write_(
+            f"CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {col_name} ON {table} BEGIN "
+            f"INSERT INTO {fts_table}({fts_table}, rowid, {col_name}) VALUES ('delete', old.id, old.{col_name}); "
+            f"INSERT INTO {fts_table}(rowid, {col_name}) VALUES (new.id, new.{col_name}); END"
+        )
+        self._db_write_(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
 
     def db_update(self, data: dict, **conditions):
         """
@@ -220,10 +773,8 @@ class DBWrite(DBInit):
         data : dict[column name: value]
         conditions : where condition, it must be a column (column_name = value)
         """
-        update = ", ".join([f"{col} = '{value}'" for col, value in data.items()])
-        condition = ", ".join(f"{col} = '{value}'" for col, value in conditions.items())
-        query = f"UPDATE {self.table_name} SET {update} WHERE {condition}"
-        self._db_write_(query)
+        query, params = compile_update(self.table_name, data, conditions, placeholder=self._placeholder_())
+        return self._db_write_(query, params)
 
     def db_delete(self, **conditions):
         """
@@ -231,9 +782,8 @@ class DBWrite(DBInit):
         ----------
         conditions : where condition, it must be a column (column_name = value)
         """
-        condition = ", ".join([f"{col}='{value}'" for col, value in conditions.items()])
-        query = f"DELETE FROM {self.table_name} WHERE {condition}"
-        self._db_write_(query)
+        query, params = compile_delete(self.table_name, conditions, placeholder=self._placeholder_())
+        return self._db_write_(query, params)
 
     def db_add_col(self, col_details: dict[str: str]):
         """
@@ -244,16 +794,19 @@ class DBWrite(DBInit):
         col_data = " ".join([f"{col_name} {data_type}" for col_name, data_type in col_details.items()])
         query = f"ALTER TABLE {self.table_name} ADD {col_data}"
         self._db_write_(query)
+        self._invalidate_schema_()
 
     def db_drop_col(self, col_name: str):
         self._check_col_exists_(col_name)
         query = f"ALTER TABLE {self.table_name} DROP COLUMN {col_name}"
         self._db_write_(query)
+        self._invalidate_schema_()
 
     def db_rename_col(self, col_old_name: str, col_new_name: str):
         self._check_col_exists_(col_name=col_old_name)
         query = f"ALTER TABLE {self.table_name} RENAME COLUMN {col_old_name} TO {col_new_name}"
         self._db_write_(query)
+        self._invalidate_schema_()
 
     def db_alter_datatype(self, **alter):
         """
@@ -264,6 +817,7 @@ class DBWrite(DBInit):
         changes = ", ".join([f"{col} {data_type}" for col, data_type in alter.items()])
         query = f"ALTER TABLE {self.table_name} ALTER COLUMN {changes}"
         self._db_write_(query)
+        self._invalidate_schema_()
 
 
 class DBMan(DBRead, DBWrite):
@@ -8,12 +8,16 @@ class SizeError(Exception):
 class Field:
 
     data_type: str = None
+    # applied to values read from the database, None keeps them as they are
+    python_type = None
     
-    def __init__(self, size: int = 0, null: bool = False, unique: bool = False):
+    def __init__(self, size: int = 0, null: bool = False, unique: bool = False, index: bool = False):
 
         self.size = size
         self.null = null
         self.unique = unique
+        # a plain index is created by the model's Manager, unique columns already have one
+        self.index = index and not unique
 
         self.max_sizes = {
             "CHAR": 255,
@@ -47,15 +51,39 @@ class Field:
     def get_query(self):
         return self._generate_field_(self.size, self.null, self.unique)
 
-    def process_value(self, value):
-        if self.size == 0:
-            self.size = self.max_sizes[self.data_type]
+    def _coercer_(self):
+        limit = self.size or self.max_sizes[self.data_type]
+
+        def coerce(value):
+            if type(value) is not str:
+                value = str(value)
+            if len(value) > limit:
+                raise SizeError(f"length of value is greater than the limit ({limit})")
+            return value
+
+        return coerce
+
+    def compile(self):
+        """
+        Returns a function which validates and converts one value of this field
+        """
+        coerce = self._coercer_()
+        if self.null:
+            def convert(value):
+                return None if value is None else coerce(value)
+        else:
+            def convert(value):
+                if value is None:
+                    raise ValueError("value can not be null")
+                return coerce(value)
+        return convert
 
-        if len(value) > self.size:
-            SizeError("length of value is greater than the limit")
+    def process_value(self, value):
+        convert = self.__dict__.get("_convert_")
+        if convert is None:
+            convert = self._convert_ = self.compile()
+        return convert(value)
 
-        return value
-        
 
 class CharField(Field):
 
@@ -75,31 +103,131 @@ class TextField(Field):
 class IntField(Field):
 
     data_type = "INT"
+    python_type = int
 
-    def process_value(self, value):
-        super().process_value(value)
-        if type(value) is not int:
+    def _coercer_(self):
+        # size is the display width of the column, not a limit on the value
+        def coerce(value):
+            if type(value) is int:
+                return value
             try:
-                value = int(value)
-            except:
-                raise TypeError(f"expected int got {type(value)}")
+                return int(value)
+            except (TypeError, ValueError):
+                raise TypeError(f"expected int got {type(value)}") from None
 
-        return value
+        return coerce
 
 
 class FloatField(Field):
 
     data_type = "FLOAT"
+    python_type = float
 
-    def process_value(self, value):
-        super().process_value(value)
-        if type(value) is not float:
+    def _coercer_(self):
+        def coerce(value):
+            if type(value) is float:
+                return value
             try:
-                value = float(value)
-            except:
-                raise TypeError(f"expected float got {type(value)}")
+                return float(value)
+            except (TypeError, ValueError):
+                raise TypeError(f"expected float got {type(value)}") from None
 
-        return value
+        return coerce
+
+
+class RowCodec:
+    """
+    Validates and converts whole rows of a model, compiled once from its fields
+
+    - encode / encode_many : python values -> tuples in column order, for writes
+    - decoder : database rows -> dicts, for reads
+
+    Parameters
+    ----------
+    fields : dict[column name: Field]
+    """
+    ERRORS = (ValueError, TypeError, SizeError)
+
+    def __init__(self, fields: dict):
+        self.columns = tuple(fields)
+        self.converters = {col: field.compile() for col, field in fields.items()}
+        self.casts = {col: field.python_type for col, field in fields.items() if field.python_type is not None}
+        self._pairs = tuple(self.converters.items())
+        self._decoders = {}
+
+    def validate(self, col_name: str, value):
+        return self.converters[col_name](value)
+
+    def encode(self, row: dict):
+        """
+        Returns the converted values of row in column order, missing columns are None
+        """
+        get = row.get
+        values = []
+        for col, convert in self._pairs:
+            try:
+                values.append(convert(get(col)))
+            except self.ERRORS as e:
+                raise type(e)(f"{col}: {e}") from None
+        return tuple(values)
+
+    def encode_dict(self, row: dict, col_names: list = None):
+        """
+        Returns {column: converted value}, of col_names only when given
+        """
+        if col_names is None:
+            return dict(zip(self.columns, self.encode(row)))
+        values = {}
+        for col in col_names:
+            try:
+                values[col] = self.converters[col](row.get(col))
+            except self.ERRORS as e:
+                raise type(e)(f"{col}: {e}") from None
+        return values
+
+    def encode_many(self, rows: list[dict]):
+        """
+        Batch path of encode, converts the rows column by column, returns one tuple per row
+        """
+        if not rows:
+            return []
+        columns = []
+        for col, convert in self._pairs:
+            try:
+                columns.append([convert(row.get(col)) for row in rows])
+            except self.ERRORS:
+                # only to name the failing row
+                for number, row in enumerate(rows):
+                    try:
+                        convert(row.get(col))
+                    except self.ERRORS as e:
+                        raise type(e)(f"row {number}, {col}: {e}") from None
+                raise
+        return list(zip(*columns))
+
+    def decoder(self, col_names: tuple):
+        """
+        Returns a function turning a database row with col_names columns into a dict
+        """
+        col_names = tuple(col_names)
+        decode = self._decoders.get(col_names)
+        if decode is not None:
+            return decode
+
+        casts = [(i, self.casts[col]) for i, col in enumerate(col_names) if col in self.casts]
+        if casts:
+            def decode(row):
+                row = list(row)
+                for i, cast in casts:
+                    if row[i] is not None and type(row[i]) is not cast:
+                        row[i] = cast(row[i])
+                return dict(zip(col_names, row))
+        else:
+            def decode(row):
+                return dict(zip(col_names, row))
+
+        self._decoders[col_names] = decode
+        return decode
 
 
 class PrimaryKeyField:
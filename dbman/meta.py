@@ -1,37 +1,136 @@
 from .dbman import DBMan
 from .dbman import DataNotFoundError
+from .fields import Field, RowCodec, SizeError
+from .cache import RowCache
+from .queryset import QuerySet
 
 class Manager(DBMan):
 
     def __init__(self, base_cls):
         self.base_cls = base_cls
         self.table_name = self.base_cls.__name__.lower()
-        self.default_keys = ("__module__", "__qualname__", "__doc__", "object")
-        self.attrs = self.base_cls.__dict__
+        self.fields = {k: v for k, v in self.base_cls.__dict__.items() if isinstance(v, Field)}
+        # compiled once per model, validates and converts every row written or read
+        self.codec = RowCodec(self.fields)
+
+        # opt-in: 'cache_size = N' (and optionally 'cache_ttl = seconds') on the model
+        self.cache = None
+        cache_size = getattr(self.base_cls, "cache_size", 0)
+        if cache_size:
+            self.cache = RowCache(
+                max_size=cache_size,
+                ttl=getattr(self.base_cls, "cache_ttl", 300),
+                unique_cols=[col for col, field in self.fields.items() if field.unique],
+            )
 
         self._create_table_()
 
     def _create_table_(self):
-        table = {k: v for k,v in self.attrs.items() if k not in self.default_keys}
         tables = self._get_table_names_()
         if self.table_name not in tables:
-            self.db_create_table(table)
+            self.db_create_table(self.fields)
             print(f"Table Created: {self.table_name}")
+        self._create_indexes_()
+
+    def _declared_indexes_(self):
+        """
+        Columns of every index declared with 'index=True' on a field or in the
+        model's 'indexes = ["col", ("col_a", "col_b"), ...]'
+        """
+        indexes = [(col,) for col, field in self.fields.items() if field.index]
+        for index in getattr(self.base_cls, "indexes", ()):
+            cols = (index,) if isinstance(index, str) else tuple(index)
+            if cols not in indexes:
+                indexes.append(cols)
+        return indexes
+
+    def _create_indexes_(self):
+        existing = set(self._get_index_names_())
+        for cols in self._declared_indexes_():
+            index_name = self._index_name_(cols)
+            if index_name not in existing:
+                self.db_create_index(cols, index_name=index_name)
+                print(f"Index Created: {index_name}")
 
+    def _from_row_(self, row: dict, cache: bool = True):
+        """
+        Build an instance from a row, partial rows (cache=False) are never cached,
+        their missing fields are None and save() only writes the fields they changed
+        """
+        if not cache:
+            obj = self.base_cls.__new__(self.base_cls)
+            for col in self.fields:
+                object.__setattr__(obj, col, None)
+            for k, v in row.items():
+                object.__setattr__(obj, k, v)
+            object.__setattr__(obj, "_dirty_", set())
+            object.__setattr__(obj, "_loaded_", frozenset(row))
+            return obj
 
-    def _get_id_(self):
-        query = f"SELECT * FROM {self.table_name} ORDER BY id DESC LIMIT 1"
-        query_data = self._db_read_(query)
-        clean_data = self._data_to_list_(query_data)
-        if clean_data:
-            return clean_data[0] + 1
-        return 1
+        obj = None
+        if self.cache is not None:
+            # reuse the live instance of this row unless it holds unsaved changes
+            obj = self.cache.identity(row.get("id"))
+            if obj is not None and obj._dirty_:
+                obj = None
+        if obj is None:
+            obj = self.base_cls.__new__(self.base_cls)
+        for k, v in row.items():
+            object.__setattr__(obj, k, v)
+        object.__setattr__(obj, "_dirty_", set())
+        object.__setattr__(obj, "_loaded_", None)
+        if self.cache is not None:
+            self.cache.put(obj)
+        return obj
+
+    def _invalidate_(self, conditions: dict):
+        if self.cache is None:
+            return
+        if len(conditions) == 1:
+            (col, value), = conditions.items()
+            if col == "id" or col in self.cache.unique_cols:
+                self.cache.invalidate_by(col, value)
+                return
+        self.cache.invalidate()
+
+    def _saved_(self, obj):
+        if self.cache is not None:
+            self.cache.put(obj)
 
     def _db_insert_(self, data):
-        self.db_insert(data)
+        return self.db_insert(data)
+
+    def bulk_insert(self, rows: list, chunk_size: int = 500, conflict_cols: list[str] = None):
+        """
+        Validate rows (dicts or pending instances) in one batch and insert them in one transaction
 
-    def _db_update_(self, data):
-        self.db_update(col_data=data, id=data["id"])
+        Returns the ids of the inserted rows, instances get their id unless conflict_cols
+        skipped some of the rows
+        """
+        data = [row if isinstance(row, dict) else row.__dict__ for row in rows]
+        values = self.codec.encode_many(data)
+        ids = self.db_insert_many(values, chunk_size=chunk_size, conflict_cols=conflict_cols,
+                                  col_names=self.codec.columns)
+        if len(ids) == len(rows):
+            for row, row_id in zip(rows, ids):
+                if not isinstance(row, dict):
+                    object.__setattr__(row, "id", row_id)
+                    row._dirty_.clear()
+                    self._saved_(row)
+        return ids
+
+    def _db_upsert_(self, data, changed):
+        """
+        Write a saved instance in one statement, only the changed columns are updated
+        """
+        self.db_upsert(data, conflict_cols=["id"], update_cols=changed)
+
+    def _db_update_partial_(self, obj_id, data):
+        """
+        Write the changed columns of an instance loaded with only(), its other
+        columns were never read so the row can not be inserted again
+        """
+        self.db_update(data, id=obj_id)
 
     def _is_exists_(self, **where):
         try:
@@ -41,53 +140,118 @@ class Manager(DBMan):
         return True
 
     def all(self):
-        return self.db_fetch_all()
+        return QuerySet(self)
+
+    def filter(self, **conditions):
+        return self.all().filter(**conditions)
+
+    def exclude(self, **conditions):
+        return self.all().exclude(**conditions)
+
+    def only(self, *col_names):
+        return self.all().only(*col_names)
+
+    def order_by(self, *col_names):
+        return self.all().order_by(*col_names)
 
     def get(self, **where):
+        if self.cache is not None and len(where) == 1:
+            (col, value), = where.items()
+            if col == "id" or col in self.cache.unique_cols:
+                obj = self.cache.get(col, value)
+                if obj is not None:
+                    return obj
+
         data = self.db_fetch_row(**where)
-        for k,v in data[0].items():
-            setattr(self.base_cls, k, v)
+        return self._from_row_(data[0])
+
+    def db_update(self, data: dict, **conditions):
+        rowcount = super().db_update(data, **conditions)
+        self._invalidate_(conditions)
+        return rowcount
 
-        return self.base_cls
+    def db_delete(self, **conditions):
+        rowcount = super().db_delete(**conditions)
+        self._invalidate_(conditions)
+        return rowcount
+
+    def cache_stats(self):
+        """
+        Returns hit / miss counters of the row cache, None if the model has no cache
+        """
+        return self.cache.stats() if self.cache is not None else None
 
 
 class DBMeta(type):
 
     def __init__(cls, name, bases, attrs, **kwargs):
+        super().__init__(name, bases, attrs, **kwargs)
         if name not in ["DBMeta", "DBMAN"]:
             cls.object = Manager(cls)
-    
-    def __call__(cls, *args, **kwargs):
-        id = cls.object._get_id_()
-        cls.id = id
+
+
+class DBMAN(metaclass=DBMeta):
+    """
+    Base class of models
+
+    Instances are not written to the database until save(), their id is None
+    (pending) until then and is assigned by the database on the first save
+    """
+
+    def __init__(self, **kwargs):
+        object.__setattr__(self, "id", None)
+        object.__setattr__(self, "_dirty_", set())
+        # columns read by only(), None when every column was loaded
+        object.__setattr__(self, "_loaded_", None)
+        for col in self.object.fields:
+            object.__setattr__(self, col, None)
         for col, value in kwargs.items():
-            processed_value = dict(cls.__dict__)[col].process_value(value)
-            setattr(cls, col, processed_value)
-        return type.__call__(cls, cls.__name__, cls.__bases__, dict(cls.__dict__), **kwargs)
+            setattr(self, col, value)
 
-    def __setattr__(cls, name, value):
+    def __setattr__(self, name, value):
+        if name == "id":
+            return object.__setattr__(self, name, value)
 
-        if name in cls.__dict__ or name in ("object", "id"):
-            if "object" in cls.__dict__:
-                if name != "id":
-                    value = cls.object.attrs[name].process_value(value)
+        convert = self.object.codec.converters.get(name)
+        if convert is None:
+            raise ValueError(f"{name} is not a field")
+        try:
+            object.__setattr__(self, name, convert(value))
+        except (ValueError, TypeError, SizeError) as e:
+            raise type(e)(f"{name}: {e}") from None
+        self._dirty_.add(name)
 
-            return type.__setattr__(cls, name, value)
-        
-        raise ValueError(f"{name} is not a field")
+    @property
+    def is_pending(self):
+        return self.id is None
 
-    def save(cls):
-        default_keys = ["__module__", "__qualname__", "__doc__", "object"]
-        data = {k: v for k,v in cls.__dict__.items() if k not in default_keys}
-        if cls.object._is_exists_(id=data["id"]):
-            cls.object._db_update_(data)
-        else:
-            cls.object._db_insert_(data)
+    def _data_(self):
+        return {col: getattr(self, col) for col in self.object.fields}
 
+    @property
+    def changed_fields(self):
+        return set(self._dirty_)
 
+    def save(self):
+        """
+        One statement per save: INSERT for pending instances, otherwise
+        INSERT ... ON CONFLICT (id) DO UPDATE of the changed fields only
 
-class DBMAN(metaclass=DBMeta):
-    
-    def __new__(self, name, bases, attrs, **kwargs):
-        return type.__new__(DBMeta, name, bases, attrs)
+        Instances loaded with only() UPDATE their changed fields, the fields
+        they did not load are neither validated nor written
+        """
+        if self._loaded_ is not None:
+            changed = [col for col in self.object.fields if col in self._dirty_]
+            if changed:
+                self.object._db_update_partial_(self.id, self.object.codec.encode_dict(self.__dict__, changed))
+            self._dirty_.clear()
+            return
 
+        data = self.object.codec.encode_dict(self.__dict__)
+        if self.is_pending:
+            object.__setattr__(self, "id", self.object._db_insert_(data))
+        elif self._dirty_:
+            changed = [col for col in self.object.fields if col in self._dirty_]
+            self.object._db_upsert_({"id": self.id, **data}, changed)
+        self._dirty_.clear()
+        self.object._saved_(self)
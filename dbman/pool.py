@@ -0,0 +1,170 @@
+###################################################
+# DBMan connection pool
+# Author      : Adeeb
+# Version     : 1.0
+# Description : thread safe pool of database connections
+###################################################
+
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition, Lock
+from time import monotonic
+
+
+class PoolTimeoutError(Exception):
+    """
+    Raise Exception when no connection is available before the checkout timeout
+    """
+    pass
+
+
+class PoolClosedError(Exception):
+    """
+    Raise Exception when a connection is checked out of a closed pool
+    """
+    pass
+
+
+class ConnectionPool:
+    """
+    Keep database connections open between queries
+
+    Parameters
+    ----------
+    connect : callable which returns a new DB-API connection
+    min_size : connections opened when the pool is created
+    max_size : maximum number of open connections
+    max_lifetime : seconds after which a connection is closed and replaced (0 = never)
+    timeout : seconds to wait for a free connection on checkout
+    health_check : run 'SELECT 1' on a connection before handing it out
+    """
+
+    def __init__(self, connect, min_size: int = 1, max_size: int = 5, max_lifetime: float = 3600,
+                 timeout: float = 30, health_check: bool = True):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("pool size must satisfy 0 <= min_size <= max_size and max_size >= 1")
+
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.health_check = health_check
+
+        self._idle = deque()
+        self._created = {}
+        self._size = 0
+        self._closed = False
+        self._cond = Condition(Lock())
+
+        for _ in range(min_size):
+            self._idle.append(self._open_())
+            self._size += 1
+
+    def __len__(self):
+        return self._size
+
+    def _open_(self):
+        conn = self._connect()
+        self._created[id(conn)] = monotonic()
+        return conn
+
+    def _discard_(self, conn):
+        self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_expired_(self, conn):
+        if not self.max_lifetime:
+            return False
+        return monotonic() - self._created.get(id(conn), 0) > self.max_lifetime
+
+    @staticmethod
+    def _is_healthy_(conn):
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+        except Exception:
+            return False
+        return True
+
+    def getconn(self):
+        """
+        Check out a connection, blocking up to timeout seconds when the pool is exhausted
+
+        Raises PoolClosedError at once when the pool is closed, also while waiting
+        """
+        deadline = monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolClosedError("connection pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(f"no free connection after {self.timeout}s (max_size={self.max_size})")
+                self._cond.wait(remaining)
+
+        try:
+            if conn is not None and (self._is_expired_(conn) or (self.health_check and not self._is_healthy_(conn))):
+                self._discard_(conn)
+                conn = None
+            if conn is None:
+                conn = self._open_()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, discard: bool = False):
+        """
+        Return a connection to the pool, closing it if discard is set or it has expired
+        """
+        with self._cond:
+            if discard or self._closed or self._is_expired_(conn):
+                self._discard_(conn)
+                self._size -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the duration of a with block
+
+        The transaction is committed on exit or rolled back on error
+        """
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard_(self._idle.pop())
+                self._size -= 1
+            self._cond.notify_all()
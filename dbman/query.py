@@ -0,0 +1,367 @@
+###################################################
+# DBMan query compiler
+# Author      : Adeeb
+# Version     : 1.0
+# Description : builds parameterized sql statements
+###################################################
+
+from functools import lru_cache
+
+QUERY_CACHE_SIZE = 256
+
+
+# ================ Statement shapes ================ #
+# Only the shape of a query (table, column names, flags) reaches these
+# functions, values never do, so every call with the same shape returns the
+# same cached sql string.
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _select_sql_(table: str, columns: tuple, where: tuple, order_by: tuple, desc: bool, limit: bool, placeholder: str):
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        query += " WHERE " + " AND ".join([f"{col} = {placeholder}" for col in where])
+    if order_by:
+        query += f" ORDER BY {', '.join(order_by)}"
+        if desc:
+            query += " DESC"
+    if limit:
+        query += f" LIMIT {placeholder}"
+    return query
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _insert_sql_(table: str, columns: tuple, placeholder: str, conflict_cols: tuple, update_cols: tuple,
+                 returning: str, batch: bool):
+    values = "%s" if batch else f"({', '.join([placeholder] * len(columns))})"
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values}"
+    if conflict_cols:
+        query += f" ON CONFLICT ({', '.join(conflict_cols)})"
+        if update_cols:
+            query += " DO UPDATE SET " + ", ".join([f"{col} = excluded.{col}" for col in update_cols])
+        else:
+            query += " DO NOTHING"
+    if returning:
+        query += f" RETURNING {returning}"
+    return query
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _update_sql_(table: str, columns: tuple, where: tuple, placeholder: str):
+    update = ", ".join([f"{col} = {placeholder}" for col in columns])
+    condition = " AND ".join([f"{col} = {placeholder}" for col in where])
+    return f"UPDATE {table} SET {update} WHERE {condition}"
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _delete_sql_(table: str, where: tuple, placeholder: str):
+    condition = " AND ".join([f"{col} = {placeholder}" for col in where])
+    return f"DELETE FROM {table} WHERE {condition}"
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _text_search_sql_(table: str, col_name: str, columns: tuple, psql: bool):
+    if columns == ("*",):
+        columns = (f"{table}.*",)
+    else:
+        columns = tuple(f"{table}.{col}" for col in columns)
+
+    if psql:
+        return (
+            f"SELECT {', '.join(columns)} FROM {table}, "
+            f"plainto_tsquery('simple', translate(lower(%s), '._', '  ')) AS query "
+            f"WHERE {col_name}_tsv @@ query ORDER BY ts_rank({col_name}_tsv, query) DESC, {table}.id LIMIT %s"
+        )
+
+    fts_table = f"{table}_{col_name}_fts"
+    return (
+        f"SELECT {', '.join(columns)} FROM {fts_table} JOIN {table} ON {table}.id = {fts_table}.rowid "
+        f"WHERE {fts_table} MATCH ? ORDER BY bm25({fts_table}), {table}.id LIMIT ?"
+    )
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _page_sql_(table: str, columns: tuple, where: tuple, key_col: str, seek: bool, backward: bool, desc: bool,
+               search_col: str, psql: bool):
+    placeholder = "%s" if psql else "?"
+    descending = desc != backward
+    op = "<" if descending else ">"
+
+    clauses = []
+    if seek:
+        if key_col == "id":
+            clauses.append(f"id {op} {placeholder}")
+        else:
+            # only the id travels in the token, the key value is looked up through the primary key
+            clauses.append(f"({key_col}, id) {op} ((SELECT {key_col} FROM {table} WHERE id = {placeholder}), {placeholder})")
+    clauses.extend([f"{col} = {placeholder}" for col in where])
+    if search_col:
+        if psql:
+            clauses.append(f"{search_col}_tsv @@ plainto_tsquery('simple', translate(lower(%s), '._', '  '))")
+        else:
+            fts_table = f"{table}_{search_col}_fts"
+            clauses.append(f"id IN (SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH ?)")
+
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    direction = " DESC" if descending else ""
+    order = [f"{key_col}{direction}"]
+    if key_col != "id":
+        order.append(f"id{direction}")
+    query += f" ORDER BY {', '.join(order)} LIMIT {placeholder}"
+    return query
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _ranked_page_sql_(table: str, columns: tuple, where: tuple, seek: bool, backward: bool, desc: bool,
+                      search_col: str, psql: bool):
+    placeholder = "%s" if psql else "?"
+    descending = desc != backward
+    op = "<" if descending else ">"
+
+    # rank grows as matches get worse, so best first is ascending like the other keys
+    inner_columns = ", ".join(f"{table}.{col}" for col in columns)
+    clauses = [f"{table}.{col} = {placeholder}" for col in where]
+    if psql:
+        tsquery = "plainto_tsquery('simple', translate(lower(%s), '._', '  '))"
+        inner = (
+            f"SELECT {inner_columns}, -ts_rank({table}.{search_col}_tsv, query) AS rank "
+            f"FROM {table}, {tsquery} AS query WHERE {table}.{search_col}_tsv @@ query"
+        )
+        seek_rank = f"(SELECT -ts_rank({search_col}_tsv, {tsquery}) FROM {table} WHERE id = %s)"
+    else:
+        fts_table = f"{table}_{search_col}_fts"
+        inner = (
+            f"SELECT {inner_columns}, bm25({fts_table}) AS rank "
+            f"FROM {fts_table} JOIN {table} ON {table}.id = {fts_table}.rowid WHERE {fts_table} MATCH ?"
+        )
+        seek_rank = f"(SELECT bm25({fts_table}) FROM {fts_table} WHERE {fts_table} MATCH ? AND rowid = ?)"
+    if clauses:
+        inner += " AND " + " AND ".join(clauses)
+
+    query = f"SELECT {', '.join(columns)} FROM ({inner}) AS ranked"
+    if seek:
+        # only the id travels in the token, its rank is computed again for the same terms
+        query += f" WHERE (rank, id) {op} ({seek_rank}, {placeholder})"
+    direction = " DESC" if descending else ""
+    query += f" ORDER BY rank{direction}, id{direction} LIMIT {placeholder}"
+    return query
+
+
+LOOKUPS = {
+    "exact": "=",
+    "ne": "<>",
+    "gt": ">",
+    "gte": ">=",
+    "lt": "<",
+    "lte": "<=",
+    "in": "IN",
+    "isnull": "IS NULL",
+    "notnull": "IS NOT NULL",
+}
+
+# lookup of the negated comparison, used by exclude()
+NEGATED_LOOKUPS = {
+    "exact": "ne",
+    "ne": "exact",
+    "gt": "lte",
+    "gte": "lt",
+    "lt": "gte",
+    "lte": "gt",
+    "isnull": "notnull",
+    "notnull": "isnull",
+}
+
+
+def _lookup_sql_(col: str, lookup: str, size: int, placeholder: str, negate: bool = False):
+    if lookup in ("isnull", "notnull"):
+        return f"{col} {LOOKUPS[NEGATED_LOOKUPS[lookup] if negate else lookup]}"
+    if lookup == "in":
+        if not size:
+            return "1 = 1" if negate else "1 = 0"
+        clause = f"{col} {'NOT IN' if negate else 'IN'} ({', '.join([placeholder] * size)})"
+    else:
+        clause = f"{col} {LOOKUPS[NEGATED_LOOKUPS[lookup] if negate else lookup]} {placeholder}"
+    # a comparison with NULL is never true, rows with a NULL column are not excluded
+    return f"({clause} OR {col} IS NULL)" if negate else clause
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _queryset_sql_(table: str, columns: tuple, where: tuple, order_by: tuple, limit: bool, offset: bool,
+                   mode: str, psql: bool):
+    placeholder = "%s" if psql else "?"
+
+    groups = []
+    for negate, conditions in where:
+        # exclude(a=1, b=2) drops rows matching both, so it keeps rows where either differs
+        clauses = [_lookup_sql_(col, lookup, size, placeholder, negate) for col, lookup, size in conditions]
+        group = (" OR " if negate else " AND ").join(clauses)
+        groups.append(group if len(clauses) == 1 and group.startswith("(") else f"({group})")
+
+    wrapped = mode == "exists" or (mode == "count" and (limit or offset))
+    if mode == "select":
+        select_cols = ", ".join(columns)
+    else:
+        select_cols = "1" if wrapped else "COUNT(*)"
+    query = f"SELECT {select_cols} FROM {table}"
+    if groups:
+        query += " WHERE " + " AND ".join(groups)
+    if order_by and mode == "select":
+        query += " ORDER BY " + ", ".join([f"{col} DESC" if desc else col for col, desc in order_by])
+    if limit:
+        query += f" LIMIT {placeholder}"
+    elif offset and not psql:
+        query += " LIMIT -1"
+    if offset:
+        query += f" OFFSET {placeholder}"
+
+    if mode == "exists":
+        return f"SELECT EXISTS ({query})"
+    if wrapped:
+        return f"SELECT COUNT(*) FROM ({query}) AS counted"
+    return query
+
+
+# ================ Public compilers ================ #
+
+def compile_select(table: str, columns: list[str] = ("*",), conditions: dict = None, order_by: list[str] = None,
+                   desc: bool = False, limit: int = None, placeholder: str = "?"):
+    """
+    Returns (sql, params) for a SELECT
+    """
+    conditions = conditions or {}
+    query = _select_sql_(table, tuple(columns), tuple(conditions), tuple(order_by or ()), desc, limit is not None, placeholder)
+    params = tuple(conditions.values())
+    if limit is not None:
+        params += (limit,)
+    return query, params
+
+
+def compile_insert(table: str, data: dict, placeholder: str = "?", conflict_cols: list[str] = None,
+                   update_cols: list[str] = None, returning: str = None):
+    """
+    Returns (sql, params) for an INSERT of one row
+    """
+    query = _insert_sql_(table, tuple(data), placeholder, tuple(conflict_cols or ()), tuple(update_cols or ()), returning, False)
+    return query, tuple(data.values())
+
+
+def compile_insert_many(table: str, columns: list[str], placeholder: str = "?", conflict_cols: list[str] = None,
+                        returning: str = None, batch: bool = False):
+    """
+    Returns the INSERT sql for executemany, or for psycopg2's execute_values when batch is set
+    """
+    return _insert_sql_(table, tuple(columns), placeholder, tuple(conflict_cols or ()), (), returning, batch)
+
+
+def compile_update(table: str, data: dict, conditions: dict, placeholder: str = "?"):
+    """
+    Returns (sql, params) for an UPDATE
+    """
+    query = _update_sql_(table, tuple(data), tuple(conditions), placeholder)
+    return query, tuple(data.values()) + tuple(conditions.values())
+
+
+def compile_delete(table: str, conditions: dict, placeholder: str = "?"):
+    """
+    Returns (sql, params) for a DELETE
+    """
+    query = _delete_sql_(table, tuple(conditions), placeholder)
+    return query, tuple(conditions.values())
+
+
+def compile_text_search(table: str, col_name: str, terms: list[str], columns: list[str] = ("*",),
+                        limit: int = 50, psql: bool = False):
+    """
+    Returns (sql, params) of a ranked full text search, every term must match
+    """
+    query = _text_search_sql_(table, col_name, tuple(columns), psql)
+    if psql:
+        return query, (" ".join(terms), limit)
+    match = " ".join(['"' + term.replace('"', '""') + '"' for term in terms])
+    return query, (match, limit)
+
+
+def compile_page(table: str, columns: list[str] = ("*",), conditions: dict = None, key_col: str = "id",
+                 seek_id: int = None, backward: bool = False, desc: bool = False, search_col: str = None,
+                 search_terms: list[str] = None, limit: int = 10, psql: bool = False):
+    """
+    Returns (sql, params) of one keyset page
+
+    Rows after (or before, when backward) the row with id seek_id in (key_col, id) order,
+    key_col "rank" orders by full text rank (search_terms required), best match first
+    """
+    conditions = conditions or {}
+    seek = seek_id is not None
+    if search_terms:
+        match = " ".join(search_terms) if psql else " ".join(['"' + term.replace('"', '""') + '"' for term in search_terms])
+
+    if key_col == "rank":
+        query = _ranked_page_sql_(table, tuple(columns), tuple(conditions), seek, backward, desc, search_col, psql)
+        params = (match,) + tuple(conditions.values())
+        if seek:
+            params += (match, seek_id, seek_id)
+        return query, params + (limit,)
+
+    query = _page_sql_(table, tuple(columns), tuple(conditions), key_col, seek, backward, desc,
+                       search_col if search_terms else None, psql)
+
+    params = ()
+    if seek:
+        params += (seek_id,) if key_col == "id" else (seek_id, seek_id)
+    params += tuple(conditions.values())
+    if search_terms:
+        params += (match,)
+    return query, params + (limit,)
+
+
+def compile_queryset(table: str, columns: list[str] = ("*",), where: list = (), order_by: list = (),
+                     limit: int = None, offset: int = None, mode: str = "select", psql: bool = False):
+    """
+    Returns (sql, params) of a QuerySet
+
+    Parameters
+    ----------
+    where : [(negate, [(column, lookup, value), ...]), ...], groups are joined with AND
+    order_by : [(column, desc), ...]
+    mode : "select", "count" or "exists"
+    """
+    shape = []
+    params = []
+    for negate, conditions in where:
+        group = []
+        for col, lookup, value in conditions:
+            if lookup == "in":
+                value = tuple(value)
+                group.append((col, lookup, len(value)))
+                params.extend(value)
+            elif lookup in ("isnull", "notnull"):
+                group.append((col, lookup, 0))
+            else:
+                group.append((col, lookup, 1))
+                params.append(value)
+        shape.append((negate, tuple(group)))
+
+    query = _queryset_sql_(table, tuple(columns), tuple(shape), tuple(order_by), limit is not None,
+                           bool(offset), mode, psql)
+    if limit is not None:
+        params.append(limit)
+    if offset:
+        params.append(offset)
+    return query, tuple(params)
+
+
+def cache_info():
+    """
+    Returns the lru_cache statistics of every statement shape cache
+    """
+    return {
+        "select": _select_sql_.cache_info(),
+        "insert": _insert_sql_.cache_info(),
+        "update": _update_sql_.cache_info(),
+        "delete": _delete_sql_.cache_info(),
+        "text_search": _text_search_sql_.cache_info(),
+        "page": _page_sql_.cache_info(),
+        "ranked_page": _ranked_page_sql_.cache_info(),
+        "queryset": _queryset_sql_.cache_info(),
+    }
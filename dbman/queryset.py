@@ -0,0 +1,168 @@
+###################################################
+# DBMan QuerySet
+# Author      : Adeeb
+# Version     : 1.0
+# Description : lazy, chainable queries over a model
+###################################################
+
+from .query import LOOKUPS, compile_queryset
+
+
+class QuerySet:
+    """
+    Lazy query over the table of a model
+
+    Nothing is read until the QuerySet is iterated, sliced with an index,
+    counted or checked for existence, and every chain compiles to one statement
+
+    Model.object.filter(file_type="video").exclude(name__in=[...]).only("name").order_by("-id").limit(10)
+
+    Filters take 'column=value' or 'column__lookup=value', lookups: exact, ne,
+    gt, gte, lt, lte, in, isnull
+    """
+
+    def __init__(self, manager, batch_size: int = 1000):
+        self.manager = manager
+        self.batch_size = batch_size
+        self._where = ()
+        self._only = None
+        self._order_by = ()
+        self._limit = None
+        self._offset = 0
+
+    def _clone_(self, **changes):
+        clone = QuerySet(self.manager, self.batch_size)
+        clone.__dict__.update({k: v for k, v in self.__dict__.items() if k not in ("manager", "batch_size")})
+        clone.__dict__.update(changes)
+        return clone
+
+    def _parse_(self, conditions: dict):
+        parsed = []
+        for key, value in conditions.items():
+            col, _, lookup = key.partition("__")
+            lookup = lookup or "exact"
+            if lookup not in LOOKUPS or lookup == "notnull":
+                raise ValueError(f"unknown lookup: '{lookup}'")
+            self.manager._check_col_exists_(col)
+            if lookup == "isnull":
+                lookup = "isnull" if value else "notnull"
+            elif value is None and lookup in ("exact", "ne"):
+                lookup = "isnull" if lookup == "exact" else "notnull"
+            parsed.append((col, lookup, value))
+        return tuple(parsed)
+
+    # ================ Chaining ================ #
+
+    def filter(self, **conditions):
+        if not conditions:
+            return self._clone_()
+        return self._clone_(_where=self._where + ((False, self._parse_(conditions)),))
+
+    def exclude(self, **conditions):
+        """
+        Drop rows matching all of the given conditions, a NULL never matches
+        so exclude(name="x") keeps the rows whose name is NULL
+        """
+        if not conditions:
+            return self._clone_()
+        return self._clone_(_where=self._where + ((True, self._parse_(conditions)),))
+
+    def only(self, *col_names):
+        """
+        Select only these columns (id is always selected), the instances are not cached
+        """
+        for col in col_names:
+            self.manager._check_col_exists_(col)
+        cols = ("id",) + tuple(col for col in col_names if col != "id")
+        return self._clone_(_only=cols)
+
+    def order_by(self, *col_names):
+        """
+        Order by columns, prefix a column with '-' for descending order
+        """
+        order = []
+        for col in col_names:
+            desc = col.startswith("-")
+            col = col.lstrip("-")
+            self.manager._check_col_exists_(col)
+            order.append((col, desc))
+        return self._clone_(_order_by=tuple(order))
+
+    def limit(self, count: int):
+        if self._limit is not None:
+            count = min(count, self._limit)
+        return self._clone_(_limit=count)
+
+    def __getitem__(self, item):
+        if isinstance(item, int):
+            if item < 0:
+                raise ValueError("negative indexing is not supported")
+            rows = list(self[item:item + 1])
+            if not rows:
+                raise IndexError("QuerySet index out of range")
+            return rows[0]
+
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError("QuerySet indices must be integers or slices without a step")
+        start = item.start or 0
+        if start < 0 or (item.stop is not None and item.stop < 0):
+            raise ValueError("negative indexing is not supported")
+
+        limit = self._limit - start if self._limit is not None else None
+        if item.stop is not None:
+            stop = max(item.stop - start, 0)
+            limit = stop if limit is None else min(limit, stop)
+        if limit is not None:
+            limit = max(limit, 0)
+        return self._clone_(_offset=self._offset + start, _limit=limit)
+
+    # ================ Evaluation ================ #
+
+    def _compile_(self, mode: str = "select"):
+        return compile_queryset(
+            self.manager.table_name,
+            columns=self._only or ("*",),
+            where=self._where,
+            order_by=self._order_by,
+            limit=self._limit,
+            offset=self._offset,
+            mode=mode,
+            psql=self.manager._is_psql_(),
+        )
+
+    @property
+    def query(self):
+        return self._compile_()[0]
+
+    def __iter__(self):
+        """
+        Stream model instances, batch_size rows at a time
+        """
+        query, params = self._compile_()
+        col_names = self._only or self.manager._get_col_names_()
+        decode = self.manager.codec.decoder(col_names)
+        rows = self.manager._db_stream_(query, params, batch_size=self.batch_size)
+        try:
+            for row in rows:
+                yield self.manager._from_row_(decode(row), cache=self._only is None)
+        finally:
+            rows.close()
+
+    def count(self):
+        query, params = self._compile_("count")
+        return self.manager._db_read_(query, params)[0][0]
+
+    def exists(self):
+        query, params = self._compile_("exists")
+        return bool(self.manager._db_read_(query, params)[0][0])
+
+    def first(self):
+        for obj in self[:1]:
+            return obj
+        return None
+
+    def __bool__(self):
+        return self.exists()
+
+    def __repr__(self):
+        return f"<QuerySet {self.query}>"
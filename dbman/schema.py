@@ -0,0 +1,47 @@
+###################################################
+# DBMan schema cache
+# Author      : Adeeb
+# Version     : 1.0
+# Description : per table column metadata cache
+###################################################
+
+from collections import namedtuple
+from threading import Lock
+
+
+class TableSchema(namedtuple("TableSchema", ["columns", "types"])):
+    """
+    columns : tuple of column names in table order
+    types   : dict[column name: declared data type]
+    """
+    __slots__ = ()
+
+    def __contains__(self, col_name):
+        return col_name in self.types
+
+
+class SchemaCache:
+    """
+    Thread safe mapping of (engine, database, table) -> TableSchema
+    """
+
+    def __init__(self):
+        self._schemas = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        return self._schemas.get(key)
+
+    def set(self, key, schema: TableSchema):
+        with self._lock:
+            self._schemas[key] = schema
+
+    def invalidate(self, key=None):
+        """
+        Drop one cached table, or every table when key is None
+        """
+        with self._lock:
+            if key is None:
+                self._schemas.clear()
+            else:
+                self._schemas.pop(key, None)
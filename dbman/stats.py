@@ -0,0 +1,196 @@
+###################################################
+# DBMan query statistics
+# Author      : Adeeb
+# Version     : 1.0
+# Description : per statement shape timing and slow query log
+###################################################
+
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+from time import perf_counter
+
+# seconds, the upper bounds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+OTHER_SHAPE = "other"
+
+
+class Histogram:
+    """
+    Counts of observed values per bucket, plus their sum and count
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def copy(self):
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.sum = self.sum
+        histogram.count = self.count
+        return histogram
+
+    def cumulative(self):
+        """
+        Returns [(upper bound, observations <= upper bound)], the last bound is inf
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float):
+        """
+        Upper bound of the bucket holding the q quantile, None without observations
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float("inf")
+
+
+class ShapeStats:
+
+    def __init__(self):
+        self.count = 0
+        self.rows = 0
+        self.errors = 0
+        self.slow = 0
+        self.latency = Histogram()
+
+
+class _Measure:
+    """
+    Times one statement, set 'rows' before the block ends
+    """
+    __slots__ = ("stats", "query", "slow_threshold", "rows", "start")
+
+    def __init__(self, stats, query, slow_threshold):
+        self.stats = stats
+        self.query = query
+        self.slow_threshold = slow_threshold
+        self.rows = 0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.stats.record(self.query, perf_counter() - self.start, self.rows,
+                              error=exc_type is not None, slow_threshold=self.slow_threshold)
+        except Exception as e:
+            # statistics never fail the statement they measure
+            print(f"query stats : record failed : {e}")
+        return False
+
+
+class QueryStats:
+    """
+    Count, latency histogram and rows of every query shape
+
+    The parameterized sql text is the shape, values never reach it. Past
+    max_shapes distinct statements new ones are counted under 'other'.
+
+    Hooks are called as hook(query, seconds, rows, error) after every statement,
+    an exception raised by a hook is printed and does not reach the caller.
+
+    Parameters
+    ----------
+    slow_threshold : seconds, slower statements are printed and kept in slow_queries
+    max_shapes : distinct statements tracked
+    """
+
+    def __init__(self, slow_threshold: float = 0.5, max_shapes: int = 500):
+        self.slow_threshold = slow_threshold
+        self.max_shapes = max_shapes
+        self.enabled = True
+        self.shapes = {}
+        self.slow_queries = deque(maxlen=50)
+        self.hooks = []
+        self._lock = Lock()
+
+    def measure(self, query: str, slow_threshold: float = None):
+        """
+        with stats.measure(query) as measure: ... measure.rows = len(rows)
+        """
+        return _Measure(self, query, slow_threshold)
+
+    def record(self, query: str, seconds: float, rows: int = 0, error: bool = False, slow_threshold: float = None):
+        if not self.enabled:
+            return
+        threshold = self.slow_threshold if slow_threshold is None else slow_threshold
+        slow = threshold is not None and seconds >= threshold
+
+        with self._lock:
+            shape = self.shapes.get(query)
+            if shape is None:
+                key = query if len(self.shapes) < self.max_shapes else OTHER_SHAPE
+                shape = self.shapes.setdefault(key, ShapeStats())
+            shape.count += 1
+            shape.rows += rows or 0
+            shape.errors += error
+            shape.latency.observe(seconds)
+            if slow:
+                shape.slow += 1
+                self.slow_queries.append((seconds, rows, query))
+
+        if slow:
+            print(f"slow query : {seconds * 1000:.1f} ms, {rows} rows : {query}")
+        for hook in self.hooks:
+            try:
+                hook(query, seconds, rows, error)
+            except Exception as e:
+                print(f"query stats : hook {getattr(hook, '__name__', hook)} failed : {e}")
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def snapshot(self, latency: bool = False):
+        """
+        Returns {query: {count, rows, errors, slow, total_s, mean_ms, p50_ms, p95_ms}},
+        with latency set also a copy of the latency Histogram under 'latency'
+        """
+        with self._lock:
+            result = {}
+            for query, shape in self.shapes.items():
+                histogram = shape.latency
+                result[query] = {
+                    "count": shape.count,
+                    "rows": shape.rows,
+                    "errors": shape.errors,
+                    "slow": shape.slow,
+                    "total_s": histogram.sum,
+                    "mean_ms": histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+                    "p50_ms": histogram.quantile(0.5) * 1000 if histogram.count else 0.0,
+                    "p95_ms": histogram.quantile(0.95) * 1000 if histogram.count else 0.0,
+                }
+                if latency:
+                    result[query]["latency"] = histogram.copy()
+            return result
+
+    def reset(self):
+        with self._lock:
+            self.shapes.clear()
+            self.slow_queries.clear()
+
+
+# shared by every DBMan instance
+query_stats = QueryStats()
@@ -0,0 +1,186 @@
+###################################################
+# DBMan write-behind queue
+# Author      : Adeeb
+# Version     : 1.0
+# Description : batches inserts on a background thread
+###################################################
+
+import atexit
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+from time import monotonic, sleep
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a row could not be queued before the timeout
+    """
+    pass
+
+
+class _Flush:
+    """
+    Marker put on the queue by flush(), set once every row queued before it is written
+    """
+
+    def __init__(self):
+        self.done = Event()
+
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    Accepts rows and inserts them from a background thread with db_insert_many
+
+    - rows are written in one batch when batch_size rows are pending or the
+      oldest pending row has waited flush_interval seconds
+    - put() blocks while max_pending rows are queued (backpressure)
+    - everything still pending is written on close(), which also runs at exit;
+      atexit does not run when the process is killed by a signal, the
+      entrypoint turns SIGTERM into a normal exit (see bot.py)
+    - a batch still failing after its retries is split in halves until the
+      rows failing on their own are found, only those are rejected (and logged)
+
+    Parameters
+    ----------
+    db : DBMan instance the rows are written with
+    batch_size : rows written per transaction
+    flush_interval : seconds a row may wait before its batch is written
+    max_pending : rows queued before put() blocks, 0 for unbounded
+    conflict_cols : passed to db_insert_many, rows conflicting on them are skipped
+    on_flush : called with the written rows and their inserted ids after every batch
+    retries : attempts of a failing batch before it is split
+    log : called with the messages of the queue, print by default
+    """
+
+    def __init__(self, db, batch_size: int = 500, flush_interval: float = 1.0, max_pending: int = 10000,
+                 conflict_cols: list[str] = None, on_flush=None, retries: int = 3, log=print):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.conflict_cols = conflict_cols
+        self.on_flush = on_flush
+        self.retries = retries
+        self.log = log
+
+        self.written = 0
+        self.dropped = 0
+        self.last_error = None
+
+        self._queue = Queue(maxsize=max_pending)
+        self._closed = False
+        self._thread = Thread(target=self._run_, name="dbman-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def put(self, row: dict, timeout: float = None):
+        """
+        Queue a row, waits up to timeout seconds (forever when None) while the queue is full
+        """
+        if self._closed:
+            raise RuntimeError("write-behind queue is closed")
+        try:
+            self._queue.put(row, timeout=timeout)
+        except Full:
+            raise QueueFullError(f"{self._queue.maxsize} rows pending") from None
+
+    def put_many(self, rows: list[dict], timeout: float = None):
+        for row in rows:
+            self.put(row, timeout)
+
+    def flush(self, timeout: float = None):
+        """
+        Wait until every row queued so far is written, returns False on timeout
+        """
+        if not self._thread.is_alive():
+            return not self._queue.qsize()
+        marker = _Flush()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout: float = None):
+        """
+        Write the pending rows and stop the background thread
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # ================ Background thread ================ #
+
+    def _insert_(self, rows):
+        return self.db.db_insert_many(rows, conflict_cols=self.conflict_cols)
+
+    def _split_(self, rows):
+        """
+        Write rows in halves until the failing ones are alone, returns (written rows, ids)
+        """
+        try:
+            return rows, self._insert_(rows)
+        except Exception as e:
+            self.last_error = e
+            if len(rows) == 1:
+                self.dropped += 1
+                self.log(f"write-behind: rejected row {rows[0]} : {e}")
+                return [], []
+        middle = len(rows) // 2
+        first_rows, first_ids = self._split_(rows[:middle])
+        last_rows, last_ids = self._split_(rows[middle:])
+        return first_rows + last_rows, first_ids + last_ids
+
+    def _write_(self, rows):
+        for attempt in range(1, self.retries + 1):
+            try:
+                ids = self._insert_(rows)
+                break
+            except Exception as e:
+                self.last_error = e
+                if attempt == self.retries:
+                    # one bad row must not take the rest of the batch with it
+                    self.log(f"write-behind: batch of {len(rows)} rows failed, writing it in parts : {e}")
+                    rows, ids = self._split_(rows)
+                    break
+                sleep(0.1 * 2 ** attempt)
+
+        # rows skipped by conflict_cols return no id
+        self.written += len(ids)
+        if self.on_flush is not None and rows:
+            try:
+                self.on_flush(rows, ids)
+            except Exception as e:
+                self.log(f"write-behind: on_flush failed : {e}")
+
+    def _run_(self):
+        rows = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Empty:
+                item = None
+
+            if isinstance(item, dict):
+                rows.append(item)
+                if deadline is None:
+                    deadline = monotonic() + self.flush_interval
+                if len(rows) < self.batch_size:
+                    continue
+
+            # batch is full, its time is up, or a flush / stop was asked for
+            if rows:
+                self._write_(rows)
+                rows = []
+            deadline = None
+
+            if isinstance(item, _Flush):
+                item.done.set()
+            elif item is _STOP:
+                return
@@ -0,0 +1,206 @@
+###################################################
+# Metrics
+# Author      : Adeeb
+# Version     : 1.0
+# Description : handler timing and prometheus text export
+###################################################
+
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter
+
+from dbman.stats import Histogram
+
+
+class HandlerStats:
+    """
+    Count, errors and latency histogram of every bot handler
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self._lock = Lock()
+
+    def record(self, name: str, seconds: float, error: bool = False):
+        with self._lock:
+            stats = self.handlers.get(name)
+            if stats is None:
+                stats = self.handlers[name] = {"count": 0, "errors": 0, "latency": Histogram()}
+            stats["count"] += 1
+            stats["errors"] += error
+            stats["latency"].observe(seconds)
+
+    def timed(self, name: str):
+        """
+        Decorator recording every call of the handler under name
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start = perf_counter()
+                error = True
+                try:
+                    result = func(*args, **kwargs)
+                    error = False
+                    return result
+                finally:
+                    try:
+                        self.record(name, perf_counter() - start, error)
+                    except Exception as e:
+                        # metrics never fail the handler they measure
+                        print(f"handler stats : record failed : {e}")
+            return wrapper
+        return decorator
+
+    def snapshot(self, latency: bool = False):
+        """
+        Returns {handler: {count, errors, mean_ms, p95_ms}}, with latency set
+        also a copy of the latency Histogram under 'latency'
+        """
+        with self._lock:
+            result = {}
+            for name, stats in self.handlers.items():
+                result[name] = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "mean_ms": stats["latency"].sum / stats["latency"].count * 1000,
+                    "p95_ms": stats["latency"].quantile(0.95) * 1000,
+                }
+                if latency:
+                    result[name]["latency"] = stats["latency"].copy()
+            return result
+
+
+# ================ Prometheus text format ================ #
+
+def _label_(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _bound_(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def _histogram_(lines: list, name: str, label: str, value: str, histogram: Histogram):
+    label = f'{label}="{_label_(value)}"'
+    for bound, count in histogram.cumulative():
+        lines.append(f'{name}_bucket{{{label},le="{_bound_(bound)}"}} {count}')
+    lines.append(f"{name}_sum{{{label}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{label}}} {histogram.count}")
+
+
+def render_prometheus(query_stats=None, handler_stats: HandlerStats = None, gauges: dict = None,
+                      counters: dict = None) -> str:
+    """
+    Returns the metrics in the prometheus text exposition format
+
+    Parameters
+    ----------
+    query_stats : dbman.stats.QueryStats
+    gauges : {metric name: (help text, value)}, values which go up and down
+    counters : {metric name: (help text, value)}, values which only grow, names end with '_total'
+    """
+    lines = []
+
+    if query_stats is not None:
+        shapes = list(query_stats.snapshot(latency=True).items())
+        lines.append("# HELP dbman_query_duration_seconds Statement latency by query shape")
+        lines.append("# TYPE dbman_query_duration_seconds histogram")
+        for query, shape in shapes:
+            _histogram_(lines, "dbman_query_duration_seconds", "query", query, shape["latency"])
+        for metric, attr, text in (
+            ("dbman_queries_total", "count", "Statements run by query shape"),
+            ("dbman_query_rows_total", "rows", "Rows returned or affected by query shape"),
+            ("dbman_query_errors_total", "errors", "Failed statements by query shape"),
+            ("dbman_slow_queries_total", "slow", "Statements slower than SLOW_QUERY_MS by query shape"),
+        ):
+            lines.append(f"# HELP {metric} {text}")
+            lines.append(f"# TYPE {metric} counter")
+            for query, shape in shapes:
+                lines.append(f'{metric}{{query="{_label_(query)}"}} {shape[attr]}')
+
+    if handler_stats is not None:
+        handlers = [(name, stats["count"], stats["errors"], stats["latency"])
+                    for name, stats in handler_stats.snapshot(latency=True).items()]
+        lines.append("# HELP bot_handler_duration_seconds Handler latency")
+        lines.append("# TYPE bot_handler_duration_seconds histogram")
+        for name, _, _, latency in handlers:
+            _histogram_(lines, "bot_handler_duration_seconds", "handler", name, latency)
+        lines.append("# HELP bot_handler_calls_total Handler calls, 'updates' counts every update received")
+        lines.append("# TYPE bot_handler_calls_total counter")
+        for name, calls, _, _ in handlers:
+            lines.append(f'bot_handler_calls_total{{handler="{_label_(name)}"}} {calls}')
+        lines.append("# HELP bot_handler_errors_total Handler calls which raised")
+        lines.append("# TYPE bot_handler_errors_total counter")
+        for name, _, errors, _ in handlers:
+            lines.append(f'bot_handler_errors_total{{handler="{_label_(name)}"}} {errors}')
+
+    for metric, (text, value) in (gauges or {}).items():
+        lines.append(f"# HELP {metric} {text}")
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {value}")
+
+    for metric, (text, value) in (counters or {}).items():
+        if not metric.endswith("_total"):
+            raise ValueError(f"counter names end with '_total': '{metric}'")
+        lines.append(f"# HELP {metric} {text}")
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+# ================ Endpoint ================ #
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    Serves render() as prometheus text on GET /metrics, from a daemon thread
+    """
+    daemon_threads = True
+
+    def __init__(self, render, host: str = "127.0.0.1", port: int = 9100):
+        self.render = render
+        super().__init__((host, port), _MetricsHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        Thread(target=self.serve_forever, name="metrics", daemon=True).start()
+        return self
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = Lock()
+
+
+def serve_metrics(render, host: str = "127.0.0.1", port: int = 9100):
+    """
+    Start the metrics endpoint once per process, later calls only swap render
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = MetricsServer(render, host, port).start()
+        else:
+            _server.render = render
+        return _server
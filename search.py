@@ -0,0 +1,311 @@
+###################################################
+# Search index
+# Author      : Adeeb
+# Version     : 1.0
+# Description : in-memory inverted index for file names
+###################################################
+
+from collections import OrderedDict
+from math import ceil
+from threading import Lock
+
+
+class ResultCache:
+    """
+    LRU cache of search results keyed by the set of query tokens
+
+    Every key is also listed under each of its tokens, so adding a file only
+    drops the cached queries whose tokens are all in the new file's name
+
+    put() can list a key under other tokens than its own, invalidate() then
+    takes a stale(key) check for the keys listed under the given tokens
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._results = OrderedDict()
+        self._tokens = {}
+        self._by_token = {}
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key: frozenset):
+        results = self._results.get(key)
+        if results is None:
+            self.misses += 1
+            return None
+        self._results.move_to_end(key)
+        self.hits += 1
+        return results
+
+    def put(self, key, results, tokens: frozenset = None):
+        if key in self._results:
+            self._drop_(key)
+        tokens = key if tokens is None else tokens
+        self._results[key] = results
+        self._tokens[key] = tokens
+        for token in tokens:
+            self._by_token.setdefault(token, set()).add(key)
+        while len(self._results) > self.max_size:
+            self._drop_(next(iter(self._results)))
+
+    def _drop_(self, key):
+        del self._results[key]
+        for token in self._tokens.pop(key):
+            keys = self._by_token[token]
+            keys.discard(key)
+            if not keys:
+                del self._by_token[token]
+
+    def invalidate(self, tokens: set, stale=None):
+        """
+        Drop the cached queries a file with these name tokens would match,
+        or, with stale given, the keys listed under the tokens it returns True for
+        """
+        if stale is None:
+            stale = lambda key: self._tokens[key] <= tokens
+        keys = set()
+        for token in tokens:
+            keys.update(self._by_token.get(token, ()))
+        stale = {key for key in keys if stale(key)}
+        for key in stale:
+            self._drop_(key)
+        self.invalidations += len(stale)
+
+    def clear(self):
+        self._results.clear()
+        self._tokens.clear()
+        self._by_token.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._results),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+class SearchIndex:
+    """
+    Inverted index from name tokens to file_uid
+
+    A token is any piece of the lower-cased name when it is split on one of
+    the separators, which is the same rule the old table scan used
+
+    Results of the last cache_size distinct queries are cached (0 disables it)
+
+    With fuzzy set the word tokens (letters only, at least 3 of them) are also
+    indexed by trigram, for fuzzy_search: a misspelled term is compared only
+    with the words sharing one of its rarest trigrams, so the cost follows the
+    vocabulary, not the number of files. Trigrams found in more than
+    MAX_TRIGRAM_POSTINGS words are too common to pick candidates with.
+    The similar words of the last cache_size terms are cached, misses included
+    """
+    SEPARATORS = (".", "_", " ")
+    MAX_TRIGRAM_POSTINGS = 5000
+
+    def __init__(self, cache_size: int = 0, fuzzy: bool = False):
+        self.postings = {}
+        self.names = {}
+        self.order = {}
+        self.cache = ResultCache(cache_size) if cache_size else None
+        self.fuzzy = fuzzy
+        self.similar_cache = ResultCache(cache_size) if cache_size and fuzzy else None
+        self.trigram_postings = {}
+        self.trigram_counts = {}
+        self._lock = Lock()
+
+    @classmethod
+    def tokenize(cls, name: str):
+        name = name.lower()
+        tokens = set()
+        for separator in cls.SEPARATORS:
+            tokens.update(name.split(separator))
+        tokens.discard("")
+        return tokens
+
+    @staticmethod
+    def is_word(token: str):
+        return len(token) >= 3 and token.isalpha()
+
+    @staticmethod
+    def trigrams(token: str):
+        # padded like pg_trgm, so short tokens and word starts get trigrams too
+        padded = f"  {token} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, file_uid):
+        return file_uid in self.names
+
+    def add(self, name: str, file_uid: str):
+        """
+        Add a file to the index, returns False if file_uid is already indexed
+        """
+        with self._lock:
+            if file_uid in self.names:
+                return False
+            self.names[file_uid] = name
+            self.order[file_uid] = len(self.order)
+            tokens = self.tokenize(name)
+            for token in tokens:
+                posting = self.postings.get(token)
+                if posting is None:
+                    posting = self.postings[token] = set()
+                    if self.fuzzy and self.is_word(token):
+                        self._add_trigrams_(token)
+                posting.add(file_uid)
+            if self.cache is not None:
+                self.cache.invalidate(tokens)
+            return True
+
+    def build(self, rows):
+        """
+        Parameters
+        ----------
+        rows : iterable of (name, file_uid)
+        """
+        for name, file_uid in rows:
+            self.add(name, file_uid)
+
+    def search(self, terms: list[str]):
+        """
+        Return [(name, file_uid)] of files matching every term, in insertion order
+        """
+        terms = frozenset(term.lower() for term in terms)
+        if not terms:
+            return []
+
+        with self._lock:
+            if self.cache is None:
+                return self._search_(terms)
+            results = self.cache.get(terms)
+            if results is None:
+                results = self._search_(terms)
+                self.cache.put(terms, results)
+            # callers get their own list, the cached one is never handed out
+            return list(results)
+
+    def _search_(self, terms: frozenset):
+        postings = []
+        for term in terms:
+            posting = self.postings.get(term)
+            if not posting:
+                return []
+            postings.append(posting)
+
+        postings.sort(key=len)
+        matches = set(postings[0])
+        for posting in postings[1:]:
+            matches.intersection_update(posting)
+            if not matches:
+                return []
+
+        return [(self.names[uid], uid) for uid in sorted(matches, key=self.order.__getitem__)]
+
+    def _add_trigrams_(self, token: str):
+        grams = self.trigrams(token)
+        self.trigram_counts[token] = len(grams)
+        for gram in grams:
+            self.trigram_postings.setdefault(gram, set()).add(token)
+
+        if self.similar_cache is not None:
+            # a new word only changes the cached terms it is similar to
+            def stale(key):
+                term, threshold = key
+                term_grams = self.trigrams(term)
+                shared = len(grams & term_grams)
+                return shared / (len(grams) + len(term_grams) - shared) >= threshold
+            self.similar_cache.invalidate(grams, stale)
+
+    def _similar_(self, term: str, threshold: float):
+        if not self.is_word(term):
+            return {}
+        if self.similar_cache is not None:
+            similar = self.similar_cache.get((term, threshold))
+            if similar is not None:
+                return similar
+
+        grams = self.trigrams(term)
+        # similarity <= shared / len(grams), a similar word shares at least
+        # min_shared trigrams and so one of the len(grams) - min_shared + 1 rarest
+        min_shared = ceil(threshold * len(grams) - 1e-9)
+        by_size = sorted(grams, key=lambda gram: len(self.trigram_postings.get(gram, ())))
+        candidates = set()
+        for gram in by_size[:len(grams) - min_shared + 1]:
+            posting = self.trigram_postings.get(gram, ())
+            if len(posting) <= self.MAX_TRIGRAM_POSTINGS:
+                candidates.update(posting)
+
+        similar = {}
+        for token in candidates:
+            count = sum(token in self.trigram_postings.get(gram, ()) for gram in grams)
+            similarity = count / (len(grams) + self.trigram_counts[token] - count)
+            if similarity >= threshold:
+                similar[token] = similarity
+
+        if self.similar_cache is not None:
+            self.similar_cache.put((term, threshold), similar, frozenset(grams))
+        return similar
+
+    def similar_tokens(self, term: str, threshold: float = 0.4):
+        """
+        Return {token: similarity} of indexed words whose trigram similarity
+        (shared / all distinct trigrams of both) with term is at least threshold
+        """
+        with self._lock:
+            return dict(self._similar_(term.lower(), threshold))
+
+    def fuzzy_search(self, terms: list[str], threshold: float = 0.4, limit: int = 50):
+        """
+        Return [(name, file_uid)] of files matching every term exactly or through
+        a similar token, best total similarity first, at most limit files
+        """
+        terms = {term.lower() for term in terms}
+        if not terms or not self.fuzzy:
+            return []
+
+        with self._lock:
+            per_term = []
+            for term in terms:
+                similar = {term: 1.0} if term in self.postings else self._similar_(term, threshold)
+                matches = {}
+                for token, similarity in similar.items():
+                    for uid in self.postings[token]:
+                        if similarity > matches.get(uid, 0):
+                            matches[uid] = similarity
+                if not matches:
+                    return []
+                per_term.append(matches)
+
+            per_term.sort(key=len)
+            scores = per_term[0]
+            for matches in per_term[1:]:
+                scores = {uid: score + matches[uid] for uid, score in scores.items() if uid in matches}
+                if not scores:
+                    return []
+
+            ranked = sorted(scores, key=lambda uid: (-scores[uid], self.order[uid]))[:limit]
+            return [(self.names[uid], uid) for uid in ranked]
+
+    def cache_stats(self):
+        """
+        Returns hit / miss counters of the result cache, None if it is disabled,
+        with fuzzy set those of the similar words cache are under 'similar'
+        """
+        with self._lock:
+            if self.cache is None:
+                return None
+            stats = self.cache.stats()
+            if self.similar_cache is not None:
+                stats["similar"] = self.similar_cache.stats()
+            return stats
@@ -0,0 +1,249 @@
+###################################################
+# Send scheduler
+# Author      : Adeeb
+# Version     : 1.0
+# Description : rate limited outbound telegram sends
+###################################################
+
+import heapq
+from collections import deque
+from concurrent.futures import Future
+from itertools import count
+from threading import Thread, Lock, Condition
+from time import monotonic, sleep
+
+from telebot.apihelper import ApiTelegramException
+
+
+class TokenBucket:
+    """
+    Allows rate calls per second on average, with bursts of up to capacity calls
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if not rate or rate <= 0:
+            raise ValueError(f"rate must be greater than 0, got {rate}")
+        if capacity is not None and capacity < 1:
+            raise ValueError(f"capacity must be at least 1, got {capacity}")
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._stamp = monotonic()
+        self._paused_until = 0
+        self._lock = Lock()
+
+    def _refill_(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def try_take(self, tokens: float = 1):
+        """
+        Take tokens if available, otherwise returns the seconds to wait for them
+        """
+        with self._lock:
+            now = monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill_(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+    def take(self, tokens: float = 1):
+        """
+        Take tokens, waiting until they are available
+        """
+        while True:
+            wait = self.try_take(tokens)
+            if not wait:
+                return
+            sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        Give no tokens for seconds (telegram's retry_after), the bucket is empty afterwards
+        """
+        with self._lock:
+            now = monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0
+            self._stamp = self._paused_until
+
+
+class _Job:
+
+    def __init__(self, chat_id, func, args, kwargs):
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.attempts = 0
+        self.future = Future()
+
+
+class SendScheduler:
+    """
+    Runs telegram sends on a pool of worker threads within telegram's rate limits
+
+    - every send takes a token from the global bucket and from its chat's bucket
+    - sends to one chat run one at a time, in the order they were submitted,
+      sends to different chats run in parallel
+    - a 429 response pauses the chat and the global bucket for retry_after
+      seconds, so no chat keeps hitting the limit, and the send is retried,
+      up to retries times
+
+    Parameters
+    ----------
+    bot : telebot.TeleBot, sends are looked up on it by name
+    workers : number of sending threads
+    global_rate : sends per second over all chats
+    chat_rate : sends per second to one chat
+    chat_burst : sends to one chat allowed back to back before chat_rate applies
+    retries : attempts of a send which keeps getting 429
+    """
+
+    def __init__(self, bot, workers: int = 4, global_rate: float = 30, chat_rate: float = 1,
+                 chat_burst: float = 1, retries: int = 5):
+        if workers < 1:
+            raise ValueError(f"workers must be at least 1, got {workers}")
+        # chat buckets are made on first use, a bad rate would only fail then
+        TokenBucket(chat_rate, chat_burst)
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.retries = retries
+        self.global_bucket = TokenBucket(global_rate)
+
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+
+        self._chats = {}        # chat_id -> deque of pending jobs
+        self._buckets = {}      # chat_id -> TokenBucket
+        self._ready = []        # heap of (ready_at, seq, chat_id), each chat is in it at most once
+        self._seq = count()
+        self._pending = 0
+        self._closed = False
+        self._cond = Condition()
+
+        self._threads = [Thread(target=self._run_, name=f"sender-{i}", daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, chat_id, method: str, *args, **kwargs):
+        """
+        Queue bot.<method>(*args, **kwargs) for chat_id, returns a Future of its result
+        """
+        return self.submit_call(chat_id, getattr(self.bot, method), *args, **kwargs)
+
+    def submit_call(self, chat_id, func, *args, **kwargs):
+        job = _Job(chat_id, func, args, kwargs)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("send scheduler is closed")
+            jobs = self._chats.get(chat_id)
+            if jobs is None:
+                # the chat is idle, schedule it; a busy chat is rescheduled by its worker
+                self._chats[chat_id] = deque([job])
+                self._schedule_(chat_id, monotonic())
+            else:
+                jobs.append(job)
+            self._pending += 1
+        return job.future
+
+    def join(self, timeout: float = None):
+        """
+        Wait until every submitted send is done, returns False on timeout
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def close(self, timeout: float = None):
+        """
+        Finish the queued sends and stop the workers
+        """
+        self.join(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _bucket_(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _schedule_(self, chat_id, ready_at):
+        heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+        self._cond.notify()
+
+    def _next_chat_(self):
+        with self._cond:
+            while True:
+                if self._closed and not self._ready:
+                    return None
+                if self._ready:
+                    wait = self._ready[0][0] - monotonic()
+                    if wait <= 0:
+                        return heapq.heappop(self._ready)[2]
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+    def _done_(self, chat_id, delay: float = 0):
+        with self._cond:
+            jobs = self._chats[chat_id]
+            if jobs:
+                self._schedule_(chat_id, monotonic() + delay)
+            else:
+                del self._chats[chat_id]
+                if len(self._buckets) > 10000:
+                    self._buckets.pop(chat_id, None)
+
+    def _finish_(self, job):
+        with self._cond:
+            self._chats[job.chat_id].popleft()
+            self._pending -= 1
+            if not self._pending:
+                self._cond.notify_all()
+
+    def _run_(self):
+        while True:
+            chat_id = self._next_chat_()
+            if chat_id is None:
+                return
+            with self._cond:
+                job = self._chats[chat_id][0]
+
+            # chat_id stays out of the ready heap while this worker owns it,
+            # which keeps its sends in order
+            wait = self._bucket_(chat_id).try_take()
+            if wait:
+                self._done_(chat_id, wait)
+                continue
+            self.global_bucket.take()
+
+            try:
+                result = job.func(*job.args, **job.kwargs)
+            except ApiTelegramException as e:
+                if e.error_code == 429 and job.attempts < self.retries:
+                    job.attempts += 1
+                    self.throttled += 1
+                    retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+                    self._bucket_(chat_id).pause(retry_after)
+                    self.global_bucket.pause(retry_after)
+                    self._done_(chat_id, retry_after)
+                    continue
+                self.failed += 1
+                job.future.set_exception(e)
+            except Exception as e:
+                self.failed += 1
+                job.future.set_exception(e)
+            else:
+                self.sent += 1
+                job.future.set_result(result)
+            self._finish_(job)
+            self._done_(chat_id)
@@ -0,0 +1,105 @@
+###################################################
+# Sessions
+# Author      : Adeeb
+# Version     : 1.0
+# Description : bounded per chat state with LRU and TTL eviction
+###################################################
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LRUStore:
+    """
+    Thread safe mapping with a maximum size and a time to live
+
+    - the least recently used key is evicted when max_size is exceeded
+    - a key which was not set or read for ttl seconds is dropped (ttl=0 disables it)
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 900):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _expired_(self, stamp, now):
+        return self.ttl and now - stamp > self.ttl
+
+    def _purge_(self, now):
+        # keys are kept in access order, so expired keys are always at the front
+        while self._data:
+            key, (stamp, _) = next(iter(self._data.items()))
+            if not self._expired_(stamp, now):
+                break
+            del self._data[key]
+
+    def get(self, key, default=None):
+        now = monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if self._expired_(item[0], now):
+                del self._data[key]
+                return default
+            self._data[key] = (now, item[1])
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        now = monotonic()
+        with self._lock:
+            self._data[key] = (now, value)
+            self._data.move_to_end(key)
+            self._purge_(now)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SearchSession:
+    """
+    Result of one /search, a page is built when it is shown
+
+    build_page(files, number, page_count) returns the reply markup of one page,
+    the last memo_size pages are kept so going back and forth does not rebuild them
+
+    fuzzy is set when the results are similar names, not exact matches
+    """
+
+    def __init__(self, results: list, page_size: int, build_page, fuzzy: bool = False, memo_size: int = 2):
+        self.results = results
+        self.page_size = page_size
+        self.page_count = max(1, -(-len(results) // page_size))
+        self.build_page = build_page
+        self.fuzzy = fuzzy
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+
+    def __len__(self):
+        return len(self.results)
+
+    def page(self, number: int):
+        number %= self.page_count
+        markup = self._memo.get(number)
+        if markup is not None:
+            self._memo.move_to_end(number)
+        else:
+            files = self.results[number * self.page_size:(number + 1) * self.page_size]
+            markup = self._memo[number] = self.build_page(files, number, self.page_count)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return markup
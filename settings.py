@@ -9,7 +9,8 @@ API_KEY = os.getenv("API_KEY")
 # Database settings 
 ####################################################
 
-DB_ENGINE = "psql"
+# "psql", or "sqlite" with DB_NAME the path of the database file (local runs)
+DB_ENGINE = os.getenv("DB_ENGINE", "psql")
 DB_CONFIG = {
     
     "NAME":os.getenv("DB_NAME"),
@@ -17,9 +18,114 @@ DB_CONFIG = {
     "PORT":os.getenv("DB_PORT"),
     "USER":os.getenv("DB_USER"),
     "PASSWORD":os.getenv("DB_PASSWORD"),
+
+    # connection pool
+    "POOL_MIN_SIZE":1,
+    "POOL_MAX_SIZE":5,
+    "POOL_MAX_LIFETIME":3600,
+    "POOL_TIMEOUT":30,
+    "POOL_HEALTH_CHECK":True,
+
+    # statements slower than this are logged
+    "SLOW_QUERY_MS":500,
 }
 TABLE_NAME = "Files"
 
+####################################################
+# Runtime settings
+####################################################
+
+# "polling" : telebot long polling (default)
+# "async"   : asyncio runtime, chats handled concurrently, in order within a chat
+# "webhook" : receive updates on a local http endpoint
+# "processes" : one process receives updates (PROCESS_INGEST) and hands them to
+#               PROCESS_WORKERS bot processes, all updates of a chat go to the same one
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+ASYNC_MAX_IN_FLIGHT = 32
+ASYNC_WORKERS = 8
+
+# "polling" or "webhook"
+PROCESS_INGEST = os.getenv("PROCESS_INGEST", "polling")
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", 4))
+# update batches queued per worker before the ingester waits
+PROCESS_QUEUE_SIZE = 1000
+# seconds between worker index refreshes, so files saved by one worker show up in the others
+INDEX_REFRESH_INTERVAL = 5
+# seconds between full index re-reads, which catch files a refresh missed
+# (postgres may commit a lower id after a higher one), 0 disables them
+INDEX_RESYNC_INTERVAL = 300
+# every worker holds its own SearchIndex, PROCESS_WORKERS times the memory of one;
+# SEARCH_BACKEND = "db" keeps the catalog out of the workers
+
+# bot api base url, e.g. http://127.0.0.1:8081/bot{0}/{1} for tools/fake_telegram.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# public url registered with telegram, leave empty to skip set_webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_HOST = "0.0.0.0"
+# PORT is set by heroku for web dynos only, webhook mode needs one in the Procfile:
+#   web: RUN_MODE=webhook python3 bot.py
+# (and the worker dyno scaled to 0, telegram refuses getUpdates while a webhook is set)
+WEBHOOK_PORT = int(os.getenv("PORT", 8443))
+WEBHOOK_PATH = "/webhook"
+# every webhook request must carry it, generated at startup when unset and WEBHOOK_URL is set,
+# required for a local webhook (tools/replay_updates.py --secret)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+# chat ids allowed to use /stats
+ADMIN_IDS = [int(chat_id) for chat_id in os.getenv("ADMIN_IDS", "").split(",") if chat_id.strip()]
+# prometheus text on http://METRICS_HOST:METRICS_PORT/metrics, 0 disables it
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+STATS_TOP_QUERIES = 5
+
+####################################################
+# Search settings
+####################################################
+
+# "memory" : inverted index built in the bot at startup
+# "db"     : database full text index (sqlite FTS5 / postgres tsvector), best match first,
+#            each page is fetched from the database when the user asks for it
+SEARCH_BACKEND = "memory"
+SEARCH_PAGE_SIZE = 10
+# per chat search results, least recently used are dropped past the limit
+SEARCH_SESSION_MAX = 1000
+SEARCH_SESSION_TTL = 900
+# results of the most recent distinct queries are cached by the memory backend, 0 disables it
+SEARCH_CACHE_SIZE = 512
+# typo tolerant search (memory backend), used when no name matches every term exactly:
+# a term also matches tokens whose trigram similarity with it is at least the threshold
+SEARCH_FUZZY = True
+SEARCH_FUZZY_THRESHOLD = 0.4
+SEARCH_FUZZY_LIMIT = 50
+
+####################################################
+# Write settings
+####################################################
+
+# new files are queued and inserted in batches by a background thread,
+# False (default) writes them before the bot replies; queued files are lost if the process is killed
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BATCH_SIZE = 500
+# seconds a queued file may wait before its batch is written
+WRITE_FLUSH_INTERVAL = 1.0
+# queued files before the bot waits for the writer
+WRITE_MAX_PENDING = 10000
+
+####################################################
+# Send settings
+####################################################
+
+# files re-sent without the forward tag go through a rate limited scheduler,
+# telegram allows about 30 messages per second overall and 1 per second to a chat,
+# in "processes" mode every worker sends at SEND_GLOBAL_RATE / PROCESS_WORKERS
+SEND_WORKERS = 4
+SEND_GLOBAL_RATE = 30
+SEND_CHAT_RATE = 1
+SEND_CHAT_BURST = 1
+# attempts of a send answered with 429 (too many requests)
+SEND_RETRIES = 5
+
 ####################################################
 # Replay messages
 ####################################################
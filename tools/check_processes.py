@@ -0,0 +1,91 @@
+###################################################
+# Process mode check
+# Author      : Adeeb
+# Version     : 1.0
+# Description : run recorded updates through the worker processes and check the catalog
+###################################################
+"""
+Usage:
+    python3 tools/check_processes.py tools/updates.sample.jsonl --workers 2
+
+Like tools/check_updates.py, but the updates are polled from
+tools/fake_telegram.py by a ProcessRunner and handled by its worker
+processes, on a temporary sqlite catalog. The workers only see the
+environment, so the settings are passed to them that way. Exits with 1 when
+a document or video of the file is missing from the catalog.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from threading import Thread
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [TOOLS_DIR, os.path.dirname(TOOLS_DIR)]
+
+from check_updates import create_catalog, media_of
+from fake_telegram import FakeTelegram
+from replay_updates import load_updates
+
+
+def check(updates: list[dict], db_path: str, workers: int = 2):
+    """
+    Returns the file_unique_id of the documents and videos of updates missing from the catalog
+    """
+    server = FakeTelegram(port=0, updates=updates)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ.update({
+        "API_KEY": os.environ.get("API_KEY") or "1:check",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{server.port}/bot{{0}}/{{1}}",
+        "RUN_MODE": "processes",
+        "DB_ENGINE": "sqlite",
+        "DB_NAME": db_path,
+        "METRICS_PORT": "0",
+    })
+
+    import settings
+    from telebot import apihelper
+    from workers import ProcessRunner
+
+    db = create_catalog(settings)
+    runner = ProcessRunner(workers=workers, api_url=settings.TELEGRAM_API_URL, refresh_interval=0)
+    runner.start()
+    try:
+        # poll until the fake api has handed out every update
+        offset = None
+        while True:
+            batch = apihelper.get_updates(settings.API_KEY, offset=offset, timeout=0)
+            if not batch:
+                break
+            offset = batch[-1]["update_id"] + 1
+            runner.dispatch(batch)
+    finally:
+        # the workers handle their queues and close their bots (write-behind queue, sends)
+        runner.stop()
+        server.shutdown()
+
+    saved = set(db.db_fetch_col(col_names=["file_uid"]))
+    return [media["file_unique_id"] for media in map(media_of, updates) if media and media["file_unique_id"] not in saved]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that recorded updates save their files in process mode")
+    parser.add_argument("file", help="json list or json lines file of updates")
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    updates = load_updates(args.file)
+    with tempfile.TemporaryDirectory() as tmp:
+        missing = check(updates, os.path.join(tmp, "catalog.sqlite"), args.workers)
+
+    files = sum(media_of(update) is not None for update in updates)
+    for file_uid in missing:
+        print(f"not saved : {file_uid}")
+    print(f"{files - len(missing)} of {files} files saved")
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+###################################################
+# Update check
+# Author      : Adeeb
+# Version     : 1.0
+# Description : run recorded updates through the bot and check the catalog
+###################################################
+"""
+Usage:
+    python3 tools/check_updates.py tools/updates.sample.jsonl
+
+The updates are handled by an in-process Bot on a temporary sqlite catalog,
+telegram is replaced by tools/fake_telegram.py. Every document and video of
+the file must end up in the catalog, exits with 1 when one is missing.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [TOOLS_DIR, os.path.dirname(TOOLS_DIR)]
+
+from fake_telegram import FakeTelegram
+from replay_updates import load_updates
+
+
+def media_of(update: dict):
+    message = update.get("message") or {}
+    return message.get("document") or message.get("video")
+
+
+def create_catalog(settings):
+    """
+    Create the files table of settings' database, same schema as data.db (name is NOT NULL)
+    """
+    from dbman import DBMan, TextField
+
+    db = DBMan()
+    db.DB_ENGINE = settings.DB_ENGINE
+    db.DB_CONFIG = settings.DB_CONFIG
+    db.table_name = settings.TABLE_NAME
+    db.db_create_table({col: TextField() for col in ("name", "file_id", "file_uid", "file_type")})
+    return db
+
+
+def check(updates: list[dict], db_path: str):
+    """
+    Returns the file_unique_id of the documents and videos of updates missing from the catalog
+    """
+    from threading import Thread
+
+    import settings
+
+    server = FakeTelegram(port=0)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    # telebot only checks the format of the token (id:secret)
+    settings.API_KEY = settings.API_KEY or "1:check"
+    settings.TELEGRAM_API_URL = f"http://127.0.0.1:{server.port}/bot{{0}}/{{1}}"
+    settings.RUN_MODE = "webhook"
+    settings.DB_ENGINE = "sqlite"
+    settings.DB_CONFIG = {"NAME": db_path}
+    settings.METRICS_PORT = 0
+
+    from telebot import types
+    from bot import Bot
+
+    db = create_catalog(settings)
+    bot = Bot(run=False)
+    try:
+        bot.process_updates([types.Update.de_json(update) for update in updates])
+    finally:
+        # writes the write-behind queue
+        bot.close()
+        server.shutdown()
+
+    saved = set(db.db_fetch_col(col_names=["file_uid"]))
+    return [media["file_unique_id"] for media in map(media_of, updates) if media and media["file_unique_id"] not in saved]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that recorded updates save their files")
+    parser.add_argument("file", help="json list or json lines file of updates")
+    args = parser.parse_args(argv)
+
+    updates = load_updates(args.file)
+    with tempfile.TemporaryDirectory() as tmp:
+        missing = check(updates, os.path.join(tmp, "catalog.sqlite"))
+
+    files = sum(media_of(update) is not None for update in updates)
+    for file_uid in missing:
+        print(f"not saved : {file_uid}")
+    print(f"{files - len(missing)} of {files} files saved")
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+###################################################
+# Fake telegram api
+# Author      : Adeeb
+# Version     : 1.0
+# Description : rate limited stand-in for TeleBot sends
+###################################################
+"""
+Usage:
+    python3 tools/fake_api.py --chats 20 --files 10
+
+Sends chats * files documents through SendScheduler to FakeTeleBot and
+prints the time taken, the 429 responses and whether every chat got its
+files in order. FakeTeleBot can also replace Bot.bot in other scripts.
+"""
+
+import argparse
+import os
+import sys
+from collections import defaultdict, deque
+from threading import Lock
+from time import monotonic, sleep, perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telebot.apihelper import ApiTelegramException
+
+
+class FakeTeleBot:
+    """
+    Records sends and answers 429 with retry_after like telegram when a
+    limit is exceeded
+
+    Parameters
+    ----------
+    latency : seconds every call takes
+    global_limit : sends accepted per second over all chats
+    chat_limit : sends accepted per second to one chat
+    retry_after : retry_after of a 429 response
+    """
+
+    def __init__(self, latency: float = 0.05, global_limit: int = 30, chat_limit: int = 1, retry_after: int = 1):
+        self.latency = latency
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.retry_after = retry_after
+        self.token = "fake"
+
+        self.sent = defaultdict(list)
+        self.rejected = 0
+        self._window = deque()
+        self._chat_windows = defaultdict(deque)
+        self._lock = Lock()
+
+    def _call_(self, method, chat_id, payload):
+        now = monotonic()
+        sleep(self.latency)
+        with self._lock:
+            chat_window = self._chat_windows[chat_id]
+            for window in (self._window, chat_window):
+                while window and now - window[0] >= 1:
+                    window.popleft()
+            if len(self._window) >= self.global_limit or len(chat_window) >= self.chat_limit:
+                self.rejected += 1
+                result_json = {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+                raise ApiTelegramException(method, None, result_json)
+            self._window.append(now)
+            chat_window.append(now)
+            self.sent[chat_id].append(payload)
+        return {"chat_id": chat_id, "payload": payload}
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._call_("sendMessage", chat_id, text)
+
+    def send_document(self, chat_id, document, **kwargs):
+        return self._call_("sendDocument", chat_id, document)
+
+    def send_video(self, chat_id, video, **kwargs):
+        return self._call_("sendVideo", chat_id, video)
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        return True
+
+
+def main():
+    from sender import SendScheduler
+
+    parser = argparse.ArgumentParser(description="Send files through SendScheduler to a fake telegram api")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--files", type=int, default=10, help="files sent to every chat")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--chat-burst", type=float, default=1, help="above 1 shows 429 retries")
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    api = FakeTeleBot(latency=args.latency)
+    scheduler = SendScheduler(api, workers=args.workers, chat_burst=args.chat_burst)
+
+    start = perf_counter()
+    futures = [
+        scheduler.submit(chat_id, "send_document", chat_id, f"file-{n}")
+        for n in range(args.files)
+        for chat_id in range(args.chats)
+    ]
+    scheduler.close()
+    elapsed = perf_counter() - start
+
+    failed = sum(1 for future in futures if future.exception() is not None)
+    in_order = all(api.sent[chat_id] == [f"file-{n}" for n in range(args.files)] for chat_id in range(args.chats))
+    print(f"sent {len(futures) - failed} / {len(futures)} in {elapsed:.2f}s")
+    print(f"429 responses : {api.rejected}, retried : {scheduler.throttled}")
+    print(f"in order : {in_order}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+###################################################
+# Fake telegram server
+# Author      : Adeeb
+# Version     : 1.0
+# Description : local bot api for running the bot without telegram
+###################################################
+"""
+Usage:
+    python3 tools/fake_telegram.py --port 8081 --updates tools/updates.sample.jsonl
+    cp data.db /tmp/catalog.sqlite
+    TELEGRAM_API_URL='http://127.0.0.1:8081/bot{0}/{1}' RUN_MODE=processes API_KEY=1:test \
+        DB_ENGINE=sqlite DB_NAME=/tmp/catalog.sqlite python3 bot.py
+
+The token only needs telegram's format (id:secret). tools/check_processes.py
+runs the same setup on its own and checks the catalog afterwards.
+
+getUpdates hands out the updates of the file (more can be POSTed as json to
+/updates), every other method is answered with a minimal valid result and
+recorded. Calls are printed as they arrive, and written as json lines to
+--calls on exit.
+"""
+
+import argparse
+import json
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from threading import Condition, Lock
+from time import time
+from urllib.parse import parse_qsl, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from replay_updates import load_updates
+
+
+class FakeTelegram(ThreadingHTTPServer):
+    """
+    Bot api stand-in on http://host:port/bot<token>/<method>
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, updates: list = ()):
+        super().__init__((host, port), _Handler)
+        self.updates = list(updates)
+        self.calls = []
+        self.message_ids = count(1000)
+        self._cond = Condition()
+        self._lock = Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def add_updates(self, updates: list):
+        with self._cond:
+            self.updates.extend(updates)
+            self._cond.notify_all()
+
+    def get_updates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        timeout = min(float(params.get("timeout") or 0), 5)
+        with self._cond:
+            self._cond.wait_for(lambda: any(u["update_id"] >= offset for u in self.updates), timeout)
+            return [update for update in self.updates if update["update_id"] >= offset][:int(params.get("limit") or 100)]
+
+    def call(self, method: str, params: dict):
+        if method == "getUpdates":
+            return self.get_updates(params)
+        with self._lock:
+            self.calls.append({"time": time(), "method": method, "params": params})
+        print(f"{method} {json.dumps(params)}", flush=True)
+
+        if method in ("deleteMessage", "answerCallbackQuery", "setWebhook", "deleteWebhook"):
+            return True
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def _params_(self):
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            body = self.rfile.read(length)
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                body = json.loads(body)
+                if url.path == "/updates":
+                    return url.path, body if isinstance(body, list) else [body]
+                params.update(body)
+            else:
+                params.update(parse_qsl(body.decode()))
+        return url.path, params
+
+    def _reply_(self, status: int, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle_(self):
+        path, params = self._params_()
+        if path == "/updates":
+            self.server.add_updates(params)
+            self._reply_(200, {"ok": True})
+            return
+        parts = path.strip("/").split("/")
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            self._reply_(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+        self._reply_(200, {"ok": True, "result": self.server.call(parts[1], params)})
+
+    do_GET = _handle_
+    do_POST = _handle_
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake telegram bot api")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--updates", help="json list or json lines of updates served by getUpdates")
+    parser.add_argument("--calls", help="write the recorded calls to this file on exit")
+    args = parser.parse_args()
+
+    server = FakeTelegram(args.host, args.port, load_updates(args.updates) if args.updates else [])
+    print(f"fake telegram on http://{args.host}:{server.port}/bot{{0}}/{{1}}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.calls:
+            with open(args.calls, "w") as file:
+                for call in server.calls:
+                    file.write(json.dumps(call) + "\n")
+
+
+if __name__ == "__main__":
+    main()
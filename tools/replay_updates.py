@@ -0,0 +1,61 @@
+###################################################
+# Webhook replay
+# Author      : Adeeb
+# Version     : 1.0
+# Description : POST recorded updates to a local webhook
+###################################################
+"""
+Usage:
+    RUN_MODE=webhook WEBHOOK_SECRET=local python3 bot.py      (leave WEBHOOK_URL empty)
+    WEBHOOK_SECRET=local python3 tools/replay_updates.py tools/updates.sample.jsonl
+
+The file may hold a json list of updates or one update per line.
+"""
+
+import argparse
+import json
+import os
+import sys
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def load_updates(file_path: str):
+    with open(file_path) as file:
+        text = file.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def post_update(url: str, update: dict, secret: str = None):
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers[SECRET_HEADER] = secret
+    request = Request(url, data=json.dumps(update).encode(), headers=headers, method="POST")
+    try:
+        with urlopen(request, timeout=10) as response:
+            return response.status
+    except HTTPError as e:
+        return e.code
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="POST recorded telegram updates to a local webhook")
+    parser.add_argument("file", help="json list or json lines file of updates")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('PORT', 8443)}/webhook")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for update in load_updates(args.file):
+        status = post_update(args.url, update, args.secret)
+        print(f"update {update.get('update_id')} : {status}")
+        failed += status != 200
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
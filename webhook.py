@@ -0,0 +1,145 @@
+###################################################
+# Webhook server
+# Author      : Adeeb
+# Version     : 1.0
+# Description : receive telegram updates over http
+###################################################
+
+import hmac
+import json
+import secrets
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Full, Queue
+from threading import Thread
+
+from telebot import types
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_secret(secret: str = None, url: str = None):
+    """
+    Returns the secret token of the webhook
+
+    Without a configured secret one is generated, it only reaches telegram
+    through set_webhook, so a url to register is required then
+    """
+    if secret:
+        return secret
+    if not url:
+        raise ValueError("webhook mode needs WEBHOOK_SECRET, or WEBHOOK_URL to register a generated one")
+    return secrets.token_urlsafe(32)
+
+
+class WebhookServer:
+    """
+    Minimal http endpoint for telegram webhooks
+
+    Accepted updates are queued and handed to bot.process_updates by a single
+    dispatcher thread, in the order they were received (as telebot Updates, or
+    as the parsed json when raw is set)
+
+    Every request must carry the secret in X-Telegram-Bot-Api-Secret-Token,
+    the path and the secret are checked before the body is read, and bodies
+    over max_body bytes are refused
+    """
+
+    def __init__(self, bot, host: str = "0.0.0.0", port: int = 8443, path: str = "/webhook",
+                 secret: str = None, queue_size: int = 1000, batch_size: int = 100, raw: bool = False,
+                 max_body: int = 1 << 20, timeout: float = 10):
+        if not secret:
+            raise ValueError("a webhook server needs a secret, see webhook_secret")
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.raw = raw
+        self.batch_size = batch_size
+        self.max_body = max_body
+        self.timeout = timeout
+        self.queue = Queue(maxsize=queue_size)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class_())
+        self.dispatcher = Thread(target=self._dispatch_, name="webhook-dispatcher", daemon=True)
+
+    def _handler_class_(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # a client sending its body slowly holds a thread for at most this long
+            timeout = server.timeout
+
+            def do_POST(self):
+                status = server.receive(self.path, self.headers, self.rfile)
+                if status != 200:
+                    # an unread body must not be taken for the next request
+                    self.close_connection = True
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def check_secret(self, headers):
+        # bytes, compare_digest refuses str with non ascii characters
+        return hmac.compare_digest(headers.get(SECRET_HEADER, "").encode(), self.secret.encode())
+
+    def receive(self, path: str, headers, rfile):
+        """
+        Validate and queue one webhook request, returns the http status code
+
+        rfile is read only once the path, the secret and Content-Length passed
+        """
+        if path != self.path:
+            return 404
+        if not self.check_secret(headers):
+            return 403
+        try:
+            length = int(headers.get("Content-Length", 0))
+        except ValueError:
+            return 400
+        if length < 0:
+            return 400
+        if length > self.max_body:
+            return 413
+        try:
+            body = rfile.read(length)
+        except OSError:
+            return 400
+        try:
+            update = json.loads(body)
+            if not self.raw:
+                update = types.Update.de_json(update)
+        except Exception:
+            return 400
+        try:
+            self.queue.put_nowait(update)
+        except Full:
+            return 503
+        return 200
+
+    def _dispatch_(self):
+        while True:
+            updates = [self.queue.get()]
+            while len(updates) < self.batch_size:
+                try:
+                    updates.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            try:
+                self.bot.process_updates(updates)
+            except Exception as e:
+                self.bot.log(f"webhook_err : {e}")
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def serve_forever(self):
+        self.dispatcher.start()
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
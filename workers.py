@@ -0,0 +1,250 @@
+###################################################
+# Process workers
+# Author      : Adeeb
+# Version     : 1.0
+# Description : one update ingester feeding bot worker processes
+###################################################
+
+import multiprocessing
+import os
+import signal
+from importlib import import_module
+from queue import Empty, Full
+from time import sleep, monotonic
+
+from telebot import apihelper, types
+
+
+def chat_id_of(update: dict):
+    """
+    Partition key of a raw update, the same chat Bot.chat_id_of returns
+    """
+    message = update.get("message") or update.get("edited_message") or update.get("channel_post")
+    if message is not None:
+        return message["chat"]["id"]
+    callback_query = update.get("callback_query")
+    if callback_query is not None:
+        return callback_query["from"]["id"]
+    return None
+
+
+def load_factory(path: str):
+    module_name, _, attr = path.partition(":")
+    return getattr(import_module(module_name), attr)
+
+
+def _interrupt_(signum, frame):
+    # SIGTERM (heroku stopping the dyno) unwinds the ingester like Ctrl-C
+    raise KeyboardInterrupt
+
+
+def worker_main(number: int, updates, bot_factory: str, api_url: str, refresh_interval: float,
+                resync_interval: float = 0, workers: int = 1):
+    """
+    Body of one worker process: runs its own Bot (own db pool, index and
+    pending forwards) on the updates of the chats assigned to it
+
+    The factory is called with processes=workers, every Bot sends within its
+    share of the global rate limit
+
+    Ctrl-C reaches the whole process group, it is left to the ingester, which
+    stops the workers. On SIGTERM, or when the ingester is gone, the worker
+    handles the batches already queued and stops; the bot is closed in any
+    case, so its queued writes and sends are not lost
+    """
+    stopping = []
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+    if api_url:
+        apihelper.API_URL = api_url
+    bot = load_factory(bot_factory)(run=False, processes=workers)
+    bot.log(f"worker {number} ready (pid {os.getpid()})")
+    try:
+        _worker_loop_(bot, updates, refresh_interval, resync_interval, stopping)
+    finally:
+        bot.close()
+        bot.log(f"worker {number} stopped")
+
+
+def _worker_loop_(bot, updates, refresh_interval: float, resync_interval: float, stopping: list):
+    parent = multiprocessing.parent_process()
+    refreshed = resynced = monotonic()
+    while True:
+        try:
+            # short timeout, a stop request is noticed within a second
+            batch = updates.get(timeout=0 if stopping else 1)
+        except Empty:
+            if stopping:
+                return
+            if parent is not None and not parent.is_alive():
+                stopping.append("orphaned")
+                continue
+            batch = []
+        if batch is None:
+            return
+
+        if resync_interval and monotonic() - resynced >= resync_interval:
+            # files a refresh missed because they were committed late
+            bot.refresh_index(full=True)
+            resynced = refreshed = monotonic()
+        elif refresh_interval and monotonic() - refreshed >= refresh_interval:
+            # files saved by the other workers
+            bot.refresh_index()
+            refreshed = monotonic()
+        if not batch:
+            continue
+
+        try:
+            bot.process_updates([types.Update.de_json(update) for update in batch])
+        except Exception as e:
+            bot.log(f"worker_err : {e}")
+
+
+class ProcessRunner:
+    """
+    This process owns getUpdates (or the webhook) and hands the raw updates to
+    worker processes, every update of a chat goes to the same worker
+
+    - per chat order and the per chat state of Bot (pending forwards, search
+      sessions) stay in one process
+    - workers are spawned, not forked, so no connection pool, lock or thread
+      of this process is inherited; they share the database through their own pools
+    - the queue of each worker holds at most queue_size batches, the ingester
+      waits when a worker falls behind
+    - every worker builds its own search index, so the index takes workers
+      times the memory of a single process (SEARCH_BACKEND "db" avoids it)
+
+    Parameters
+    ----------
+    workers : number of worker processes
+    bot_factory : 'module:callable' called with run=False and processes=workers in every worker
+    api_url : (optional) telebot.apihelper.API_URL, e.g. a local fake api
+    refresh_interval : seconds between index refreshes in the workers, 0 disables them
+    resync_interval : seconds between full index re-reads in the workers, 0 disables them
+    """
+
+    def __init__(self, workers: int = 4, queue_size: int = 1000, bot_factory: str = "bot:Bot",
+                 api_url: str = None, refresh_interval: float = 5, poll_timeout: int = 20,
+                 resync_interval: float = 0):
+        self.workers = workers
+        self.bot_factory = bot_factory
+        self.api_url = api_url
+        self.refresh_interval = refresh_interval
+        self.resync_interval = resync_interval
+        self.poll_timeout = poll_timeout
+
+        self.context = multiprocessing.get_context("spawn")
+        self.queues = [self.context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.processes = []
+        if api_url:
+            apihelper.API_URL = api_url
+
+    def log(self, txt: str) -> None:
+        print(f"[ingester] {txt}")
+
+    def start(self):
+        for number, updates in enumerate(self.queues):
+            process = self.context.Process(
+                target=worker_main,
+                args=(number, updates, self.bot_factory, self.api_url, self.refresh_interval,
+                      self.resync_interval, self.workers),
+                name=f"bot-worker-{number}",
+            )
+            process.start()
+            self.processes.append(process)
+        return self
+
+    def partition(self, update: dict):
+        chat_id = chat_id_of(update)
+        key = chat_id if chat_id is not None else update.get("update_id", 0)
+        return key % self.workers
+
+    def dispatch(self, updates: list[dict]):
+        """
+        Send raw updates to their workers, one batch per worker, order kept
+        """
+        batches = {}
+        for update in updates:
+            batches.setdefault(self.partition(update), []).append(update)
+        for number, batch in batches.items():
+            self.queues[number].put(batch)
+
+    def process_updates(self, updates: list[dict]):
+        # called by WebhookServer
+        self.dispatch(updates)
+
+    def poll(self, token: str):
+        offset = None
+        while True:
+            try:
+                updates = apihelper.get_updates(token, offset=offset, timeout=self.poll_timeout)
+            except Exception as e:
+                self.log(f"poll_err : {e}")
+                sleep(1)
+                continue
+            if updates:
+                offset = updates[-1]["update_id"] + 1
+                self.dispatch(updates)
+
+    def stop(self, timeout: float = 25):
+        """
+        Let every worker finish its queue, then wait up to timeout seconds in
+        total (heroku kills the dyno 30 seconds after SIGTERM) for them to exit
+        """
+        deadline = monotonic() + timeout
+        for updates in self.queues:
+            try:
+                updates.put(None, timeout=max(deadline - monotonic(), 0.1))
+            except Full:
+                pass
+        for process in self.processes:
+            process.join(max(deadline - monotonic(), 0))
+            if process.is_alive():
+                self.log(f"{process.name} did not stop in time, terminating it")
+                process.terminate()
+        self.processes = []
+
+    def run(self, token: str, ingest: str = "polling", url: str = None, secret: str = None, **webhook):
+        """
+        Start the workers and ingest updates until interrupted
+
+        Parameters
+        ----------
+        ingest : "polling" or "webhook"
+        url : (optional) public url of the webhook, registered with telegram
+        secret : secret of the webhook, see webhook.webhook_secret
+        webhook : host, port and path of the WebhookServer
+
+        Ctrl-C and SIGTERM stop the ingester, the workers then finish their
+        queues and close their bots before it returns
+        """
+        signal.signal(signal.SIGTERM, _interrupt_)
+        server = None
+        if ingest == "webhook":
+            from webhook import WebhookServer, webhook_secret
+
+            # checked before the workers start, a missing secret fails here
+            secret = webhook_secret(secret, url)
+            server = WebhookServer(self, raw=True, secret=secret, **webhook)
+
+        self.start()
+        self.log(f"{self.workers} workers started, ingesting with {ingest}")
+        try:
+            if server is not None:
+                if url:
+                    apihelper.delete_webhook(token)
+                    apihelper.set_webhook(token, url=url, secret_token=secret)
+                self.log(f"webhook on port {server.port}")
+                server.serve_forever()
+            else:
+                self.poll(token)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # already stopping, a second SIGTERM must not cut the workers' drain short
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            if server is not None:
+                # serve_forever ran in this thread and has returned, only the socket is left
+                server.httpd.server_close()
+            self.stop()